@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Runs tyr's builds against a local stand in for AWS and reports what each
+one cost: wall time, the AWS API calls it made by operation, and the time
+tyr itself spent outside of them.
+
+    $ pip install -r benchmarks/requirements.txt
+    $ python -m benchmarks.run --output results.json
+    $ python -m benchmarks.run --baseline results.json
+
+The run fails if a build fails, other than those listed in
+scenarios.EXPECTED_FAILURES. With a baseline, it also fails if any build
+makes more API calls than it did then, or its overhead grows by more than
+the tolerance.
+"""
+
+from benchmarks.environment import Environment
+from benchmarks.scenarios import EXPECTED_FAILURES, SCENARIOS
+from benchmarks.stubs import ApiCalls, offline
+from tyr.helpers import tracer
+import click
+import json
+import logging
+import sys
+import time
+import traceback
+
+
+def measure(name, build):
+
+    calls = ApiCalls()
+
+    with Environment() as env:
+        target = build(env)
+        tracer.enable()
+        tracer.reset()
+
+        with offline():
+            with calls.installed():
+                error = None
+                start, cpu = time.time(), time.clock()
+
+                try:
+                    target.autorun()
+                except Exception as e:
+                    error = '{name}: {error}'.format(
+                        name=e.__class__.__name__, error=e)
+                    logging.getLogger('Tyr.Benchmarks').debug(
+                        traceback.format_exc())
+
+                wall, cpu = time.time() - start, time.clock() - cpu
+
+    return {
+        'name': name,
+        'wall': wall,
+        'cpu': cpu,
+        'api_time': calls.busy,
+        'overhead': wall - calls.busy,
+        'calls': calls.total,
+        'operations': dict(calls.counts),
+        'spans': len(tracer.spans),
+        'error': error
+    }
+
+
+def report(results):
+
+    row = '{0:<26} {1:>8} {2:>8} {3:>9} {4:>6}'
+
+    click.echo(row.format('Build', 'Wall', 'AWS', 'Overhead', 'Calls'))
+
+    for result in results:
+        click.echo(row.format(result['name'],
+                              '{0:.3f}'.format(result['wall']),
+                              '{0:.3f}'.format(result['api_time']),
+                              '{0:.3f}'.format(result['overhead']),
+                              result['calls']))
+
+        if result['error'] and result['name'] in EXPECTED_FAILURES:
+            click.echo('    failed as expected: {reason}'.format(
+                       reason=EXPECTED_FAILURES[result['name']]))
+        elif result['error']:
+            click.echo('    failed with {error}'.format(
+                       error=result['error']))
+        elif result['name'] in EXPECTED_FAILURES:
+            click.echo('    passed, but is listed as an expected failure')
+
+    operations = {}
+
+    for result in results:
+        for operation, count in result['operations'].items():
+            operations[operation] = operations.get(operation, 0) + count
+
+    click.echo('')
+    click.echo('{0:<48} {1:>6}'.format('Operation', 'Calls'))
+
+    for operation, count in sorted(operations.items(),
+                                   key=lambda item: (-item[1], item[0])):
+        click.echo('{0:<48} {1:>6}'.format(operation, count))
+
+
+def regressions(results, baseline, tolerance):
+
+    baseline = dict((result['name'], result) for result in baseline)
+
+    for result in results:
+        before = baseline.get(result['name'])
+
+        if before is None:
+            continue
+
+        if result['error'] and not before['error']:
+            yield '{name} now fails with {error}'.format(**result)
+
+        if result['calls'] > before['calls']:
+            grown = sorted(operation for operation, count
+                           in result['operations'].items()
+                           if count > before['operations'].get(operation, 0))
+
+            yield ('{name} makes {after} API calls, up from {before} '
+                   '({operations})'.format(name=result['name'],
+                                           after=result['calls'],
+                                           before=before['calls'],
+                                           operations=', '.join(grown)))
+
+        if result['overhead'] > before['overhead'] * (1 + tolerance):
+            yield ('{name} spends {after:.3f}s outside of AWS calls, up from '
+                   '{before:.3f}s'.format(name=result['name'],
+                                          after=result['overhead'],
+                                          before=before['overhead']))
+
+
+@click.command()
+@click.option('--only', multiple=True,
+              help='Run only the named builds, such as MongoCluster')
+@click.option('--output', type=click.Path(), default=None,
+              help='Write the results to this file as JSON')
+@click.option('--baseline', type=click.Path(exists=True), default=None,
+              help='Fail on regressions against results from an earlier run')
+@click.option('--tolerance', type=click.FLOAT, default=0.5,
+              help='How much the overhead may grow over the baseline')
+@click.option('--verbose', is_flag=True, default=False)
+def benchmark(only, output, baseline, tolerance, verbose):
+
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s [%(name)s] %(levelname)s: '
+                        '%(message)s', datefmt='%H:%M:%S')
+
+    if not verbose:
+        # Servers and clusters add handlers of their own, so this is the
+        # only way to keep their output out of the report
+        logging.disable(logging.CRITICAL)
+
+    scenarios = [(name, build) for name, build in SCENARIOS
+                 if not only or name in only]
+
+    results = [measure(name, build) for name, build in scenarios]
+
+    report(results)
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    failed = [result['name'] for result in results if result['error'] and
+              result['name'] not in EXPECTED_FAILURES]
+    found = []
+
+    if baseline is not None:
+        with open(baseline, 'r') as f:
+            found = list(regressions(results, json.load(f), tolerance))
+
+        for regression in found:
+            click.echo(regression, err=True)
+
+    if failed or found:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    benchmark()
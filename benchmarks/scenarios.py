@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from benchmarks.environment import MAIL_NAME, ZONE
+from tyr.clusters.autoscaling import AutoScaler
+from tyr.clusters.iis import IISCluster
+from tyr.clusters.mongo import MongoCluster
+from tyr.clusters.nginx import NginxCluster
+from tyr.servers.cache import CacheServer
+from tyr.servers.elasticsearch import ElasticsearchServer
+from tyr.servers.eureka import EurekaServer
+from tyr.servers.iis import IISNode
+from tyr.servers.kafka import KafkaBroker
+from tyr.servers.mongo import (MongoArbiterNode, MongoConfigNode,
+                               MongoDataNode, MongoDataWarehousingNode)
+from tyr.servers.nginx import NginxServer
+from tyr.servers.postfix import PostfixMaster
+from tyr.servers.rabbit import RabbitMQServer
+from tyr.servers.scripts import ScriptsServer
+from tyr.servers.server import Server
+from tyr.servers.solr import SolrMasterNode, SolrSlaveNode
+from tyr.servers.zookeeper import ZookeeperServer
+
+
+def server(cls, **extra):
+    """
+    A scenario which runs `cls(...).autorun()` as a lone server build.
+    """
+
+    def build(env):
+
+        parameters = env.server_parameters
+        parameters.update(dns_zones=env.dns_zones, chef_path=env.chef_path)
+        parameters.update(extra)
+
+        return cls(**parameters)
+
+    return build
+
+
+def iis_node(env):
+
+    return IISNode(instance_type='m4.large', **env.server_parameters)
+
+
+def mongo_cluster(env):
+
+    parameters = env.server_parameters
+    del parameters['subnet_id']
+
+    return MongoCluster(replica_set=1, data_nodes=2, mongodb_version='3.2.9',
+                        dns_zones=env.dns_zones, chef_path=env.chef_path,
+                        **parameters)
+
+
+def autoscaling_cluster(cls):
+
+    def build(env):
+
+        parameters = env.server_parameters
+        subnet_id = parameters.pop('subnet_id')
+
+        return cls(subnet_ids=[subnet_id], availability_zones=[ZONE],
+                   tags=[{'name': 'Group', 'value': 'benchmark'}],
+                   **parameters)
+
+    return build
+
+
+class AutoScalerBuild(object):
+    """
+    AutoScaler takes a configured template node rather than configuring
+    one itself, as the clusters do before running it.
+    """
+
+    def __init__(self, env):
+
+        parameters = env.server_parameters
+        self.subnet_id = parameters['subnet_id']
+
+        self.node = NginxServer(dns_zones=env.dns_zones,
+                                chef_path=env.chef_path, **parameters)
+
+    def autorun(self):
+
+        self.node.establish_logger()
+        self.node.configure()
+
+        AutoScaler(launch_configuration='s-benchmark-lc',
+                   autoscaling_group='s-benchmark-asg',
+                   node_obj=self.node,
+                   tags=[{'name': 'Group', 'value': 'benchmark'}],
+                   root_volume_size=20,
+                   availability_zones=[ZONE],
+                   subnet_ids=[self.subnet_id]).autorun()
+
+
+SCENARIOS = [
+    ('Server', server(Server, server_type='base')),
+    ('CacheServer', server(CacheServer)),
+    ('ElasticsearchServer', server(ElasticsearchServer)),
+    ('EurekaServer', server(EurekaServer)),
+    ('IISNode', iis_node),
+    ('KafkaBroker', server(KafkaBroker)),
+    ('MongoArbiterNode', server(MongoArbiterNode, replica_set=1)),
+    ('MongoConfigNode', server(MongoConfigNode)),
+    ('MongoDataNode', server(MongoDataNode, replica_set=1)),
+    ('MongoDataWarehousingNode', server(MongoDataWarehousingNode,
+                                        replica_set=1)),
+    ('NginxServer', server(NginxServer)),
+    ('PostfixMaster', server(PostfixMaster, mail_name=MAIL_NAME)),
+    ('RabbitMQServer', server(RabbitMQServer, rabbit_user='tyr',
+                              rabbit_pass='tyr')),
+    ('ScriptsServer', server(ScriptsServer)),
+    ('SolrMasterNode', server(SolrMasterNode)),
+    ('SolrSlaveNode', server(SolrSlaveNode, master='solr-master')),
+    ('ZookeeperServer', server(ZookeeperServer)),
+    ('MongoCluster', mongo_cluster),
+    ('NginxCluster', autoscaling_cluster(NginxCluster)),
+    ('IISCluster', autoscaling_cluster(IISCluster)),
+    ('AutoScaler', AutoScalerBuild)
+]
+
+# Builds which fail for reasons of their own, so they are reported but do
+# not fail the run
+EXPECTED_FAILURES = {
+    'MongoDataWarehousingNode': 'bake reads self.chef_node, which is never '
+                                'set'
+}
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from boto.connection import AWSAuthConnection
+from tyr.helpers import ssh_pool
+from tyr.helpers.accounting import operation
+import chef
+import collections
+import contextlib
+import importlib
+import requests
+import threading
+import time
+
+# The package exports the mongo_admin factory under the module's own name
+mongo_admin = importlib.import_module('tyr.helpers.mongo_admin')
+
+
+@contextlib.contextmanager
+def patched(target, **attributes):
+    """
+    Replace attributes of `target` for the duration of the block.
+    """
+
+    # Attributes looked up through a class are deleted again afterwards
+    # rather than copied onto `target`
+    missing = object()
+    saved = dict((name, vars(target).get(name, missing))
+                 for name in attributes)
+
+    for name, value in attributes.items():
+        setattr(target, name, value)
+
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is missing:
+                delattr(target, name)
+            else:
+                setattr(target, name, value)
+
+
+class ApiCalls(object):
+    """
+    Counts and times every request boto sends, by service and operation.
+    """
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+
+        with self.lock:
+            self.counts = collections.Counter()
+            self.latency = collections.defaultdict(float)
+            self.intervals = []
+
+    def record(self, request, start, end):
+
+        key = '{service}:{operation}'.format(
+            service=request.host.split('.')[0], operation=operation(request))
+
+        with self.lock:
+            self.counts[key] += 1
+            self.latency[key] += end - start
+            self.intervals.append((start, end))
+
+    @property
+    def total(self):
+
+        return sum(self.counts.values())
+
+    @property
+    def busy(self):
+        """
+        Seconds during which at least one request was in flight, so calls
+        made at once from several threads are only counted once.
+        """
+
+        busy = 0
+        until = None
+
+        for start, end in sorted(self.intervals):
+            if until is not None and start < until:
+                start = until
+            if end > start:
+                busy += end - start
+            until = max(until, end) if until is not None else end
+
+        return busy
+
+    @contextlib.contextmanager
+    def installed(self):
+
+        calls = self
+        mexe = AWSAuthConnection._mexe
+
+        def counted(self, request, *args, **kwargs):
+
+            start = time.time()
+
+            try:
+                return mexe(self, request, *args, **kwargs)
+            finally:
+                calls.record(request, start, time.time())
+
+        with patched(AWSAuthConnection, _mexe=counted):
+            yield self
+
+
+CHEF_LOG = ('[2016-01-01T00:00:00+00:00] INFO: Chef Run complete in 1.0 '
+            'seconds\n')
+
+
+class FakeChefObject(object):
+
+    ATTRIBUTES = {
+        'couchbase.server.username': 'tyr',
+        'couchbase.server.password': 'tyr',
+        'couchbase.server.memory_quota_mb': 1024,
+        'couchbase.server.port': 8091
+    }
+
+    def __init__(self, name, *args, **kwargs):
+
+        self.name = name
+        self.attributes = self
+
+    def get_dotted(self, key):
+
+        return self.ATTRIBUTES.get(key)
+
+    def delete(self):
+
+        pass
+
+
+class FakeChefAPI(object):
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        return False
+
+
+class FakeMongoAdmin(object):
+    """
+    Answers replica set commands as a healthy one member replica set.
+    """
+
+    def __init__(self, host, port=27018, tunnel=True, timeout=10):
+
+        self.host = host
+        self.port = port
+
+    def status(self, initial_sync=False):
+
+        return {
+            'ok': 1,
+            'set': 'benchmark',
+            'members': [{
+                'name': '{host}:{port}'.format(host=self.host,
+                                               port=self.port),
+                'stateStr': 'PRIMARY',
+                'health': 1
+            }]
+        }
+
+    def is_master(self):
+
+        return {'ok': 1, 'ismaster': True, 'setName': 'benchmark'}
+
+    def initiate(self):
+
+        return {'ok': 1}
+
+    def add_member(self, name, arbiter=False, hidden=False):
+
+        return {'ok': 1}
+
+
+class FakeResponse(object):
+
+    status_code = 202
+
+    def json(self):
+
+        return {}
+
+
+@contextlib.contextmanager
+def offline():
+    """
+    Stand in for everything other than AWS: commands over SSH succeed with
+    no output, the Chef Client log reports a successful run straight away,
+    the Chef Server has nothing to delete, and mongod is a healthy
+    primary.
+    """
+
+    def run(host, command, user='ec2-user'):
+
+        return '', ''
+
+    def lines(host, command, user='ec2-user', interval=None):
+
+        yield CHEF_LOG
+
+    def put(host, local_path, remote_path, user='ec2-user'):
+
+        pass
+
+    mongo_admin.admins.clear()
+
+    with patched(ssh_pool, run=run, lines=lines, put=put), \
+            patched(chef, autoconfigure=lambda path=None: FakeChefAPI(),
+                    Node=FakeChefObject, Client=FakeChefObject), \
+            patched(mongo_admin, MongoAdmin=FakeMongoAdmin), \
+            patched(requests, post=lambda *args, **kwargs: FakeResponse()):
+        yield
+
+    mongo_admin.admins.clear()
@@ -15,7 +15,7 @@ setup(
     version='0.0.1',
     author='Mihir Singh (@citruspi)',
     author_email='mihir.singh@hudl.com',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     test_suite='nose.collector',
     zip_safe=False,
     include_package_data=True,
@@ -30,7 +30,9 @@ setup(
         'requests',
         'nose',
         'cloudspecs',
-        'boto3'
+        'boto3',
+        'futures',
+        'pymongo'
     ],
     scripts=[
         'scripts/replace-mongodb-servers',
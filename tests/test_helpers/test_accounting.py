@@ -0,0 +1,46 @@
+from nose.tools import raises
+from tyr.helpers import ApiAccount, tracer
+from tyr.servers.exceptions import ApiBudgetExceeded
+
+
+class Request(object):
+
+    method = 'POST'
+    path = '/'
+
+    def __init__(self, action):
+        self.params = {'Action': action}
+
+
+class Connection(object):
+
+    host = 'ec2.us-east-1.amazonaws.com'
+
+    def _mexe(self, request, *args, **kwargs):
+        return request.params['Action']
+
+
+def test_calls_counted_by_phase():
+    account = ApiAccount()
+    connection = account.instrument(Connection())
+
+    with tracer.span('configure'):
+        connection._mexe(Request('DescribeImages'))
+        connection._mexe(Request('DescribeImages'))
+
+    with tracer.span('launch'):
+        assert connection._mexe(Request('RunInstances')) == 'RunInstances'
+
+    assert account.total == 3
+    assert account.by_phase()['configure'][0] == 2
+    assert account.by_operation()['ec2:RunInstances'][0] == 1
+    assert 'ec2:DescribeImages' in account.summary()
+
+
+@raises(ApiBudgetExceeded)
+def test_enforced_budget():
+    account = ApiAccount(budget=1, enforce=True)
+    connection = account.instrument(Connection())
+
+    connection._mexe(Request('DescribeImages'))
+    connection._mexe(Request('DescribeImages'))
@@ -0,0 +1,74 @@
+from tyr.helpers import RegionCache
+import threading
+
+
+def test_fetches_once_per_region():
+    cache = RegionCache(ttl=300)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return ['us-east-1a', 'us-east-1c']
+
+    assert cache.get('us-east-1', 'zones', fetch) == ['us-east-1a',
+                                                      'us-east-1c']
+    assert cache.get('us-east-1', 'zones', fetch) == ['us-east-1a',
+                                                      'us-east-1c']
+    assert len(calls) == 1
+
+    cache.get('us-west-2', 'zones', fetch)
+
+    assert len(calls) == 2
+
+
+def test_expired_entries_are_refetched():
+    cache = RegionCache(ttl=0)
+    calls = []
+
+    cache.get('us-east-1', 'key-pairs', lambda: calls.append(1))
+    cache.get('us-east-1', 'key-pairs', lambda: calls.append(1))
+
+    assert len(calls) == 2
+
+
+def test_invalidate():
+    cache = RegionCache(ttl=300)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return len(calls)
+
+    cache.get('us-east-1', 'zones', fetch)
+    cache.get('us-east-1', 'key-pairs', fetch)
+    cache.get('us-west-2', 'zones', fetch)
+
+    cache.invalidate('us-east-1', 'zones')
+
+    assert cache.get('us-east-1', 'zones', fetch) == 4
+    assert cache.get('us-east-1', 'key-pairs', fetch) == 2
+
+    cache.invalidate()
+
+    assert cache.get('us-west-2', 'zones', fetch) == 5
+
+
+def test_other_keys_fetched_while_one_is_in_flight():
+    cache = RegionCache(ttl=300)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'slow'
+
+    thread = threading.Thread(target=cache.get,
+                              args=('us-east-1', 'subnets', slow))
+    thread.start()
+    started.wait(5)
+
+    assert cache.get('us-east-1', 'zones', lambda: 'fast') == 'fast'
+
+    release.set()
+    thread.join()
@@ -0,0 +1,31 @@
+from nose.tools import raises
+from tyr.helpers import ConnectionRegistry
+from tyr.servers.exceptions import RegionDoesNotExist
+
+
+class Connection(object):
+
+    def __init__(self, region):
+        self.host = 'ec2.{region}.amazonaws.com'.format(region=region)
+
+    def _mexe(self, request, *args, **kwargs):
+        return request
+
+
+def connect(region):
+    return Connection(region) if region != 'nowhere' else None
+
+
+def test_connections_shared_per_region():
+    registry = ConnectionRegistry(connect={'ec2': connect})
+
+    east = registry.get('ec2', 'us-east-1')
+
+    assert registry.get('ec2', 'us-east-1') is east
+    assert registry.get('ec2', 'us-west-2') is not east
+    assert east.tyr_accounted
+
+
+@raises(RegionDoesNotExist)
+def test_unknown_region():
+    ConnectionRegistry(connect={'ec2': connect}).get('ec2', 'nowhere')
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+from tyr.helpers import IndexAllocator
+from tyr.servers.exceptions import NoIndexAvailable
+from nose.tools import raises
+
+
+class Instance(object):
+
+    def __init__(self, name):
+        self.tags = {'Name': name}
+
+
+class Reservation(object):
+
+    def __init__(self, names):
+        self.instances = [Instance(name) for name in names]
+
+
+class Connection(object):
+
+    def __init__(self, names):
+        self.names = names
+        self.queries = 0
+
+    def get_all_instances(self, filters=None):
+        self.queries += 1
+        return [Reservation(self.names)]
+
+
+directory = None
+
+
+def setup_directory():
+    global directory
+    directory = tempfile.mkdtemp()
+
+
+def cleanup_directory():
+    shutil.rmtree(directory)
+
+
+def allocator():
+    return IndexAllocator(path=os.path.join(directory, 'reservations.json'))
+
+
+def test_reserves_free_indexes():
+    conn = Connection(['s-monolith-mongo-rs1-use1c-01',
+                       's-monolith-mongo-rs1-use1c-03',
+                       's-monolith-mongo-rs1-use1d-01'])
+
+    allocated = allocator().reserve(conn, {
+        's-monolith-mongo-rs1-use1c-': 2,
+        's-monolith-mongo-rs1-use1d-': 1
+    })
+
+    assert allocated['s-monolith-mongo-rs1-use1c-'] == ['02', '04']
+    assert allocated['s-monolith-mongo-rs1-use1d-'] == ['02']
+    assert conn.queries == 1
+
+test_reserves_free_indexes.setUp = setup_directory
+test_reserves_free_indexes.tearDown = cleanup_directory
+
+
+def test_reservations_are_shared():
+    conn = Connection([])
+
+    first = allocator().reserve(conn, {'s-monolith-web-use1c-': 1})
+    second = allocator().reserve(conn, {'s-monolith-web-use1c-': 1})
+
+    assert first['s-monolith-web-use1c-'] == ['01']
+    assert second['s-monolith-web-use1c-'] == ['02']
+
+    allocator().release('s-monolith-web-use1c-', ['01'])
+
+    third = allocator().reserve(conn, {'s-monolith-web-use1c-': 1})
+
+    assert third['s-monolith-web-use1c-'] == ['01']
+
+test_reservations_are_shared.setUp = setup_directory
+test_reservations_are_shared.tearDown = cleanup_directory
+
+
+@raises(NoIndexAvailable)
+def test_exhausted_prefix():
+    names = ['s-monolith-web-use1c-{i:02d}'.format(i=i) for i in range(1, 99)]
+
+    allocator().reserve(Connection(names), {'s-monolith-web-use1c-': 2})
+
+test_exhausted_prefix.setUp = setup_directory
+test_exhausted_prefix.tearDown = cleanup_directory
@@ -0,0 +1,26 @@
+import time
+from tyr.helpers import for_each
+
+
+def test_results_keep_order():
+    def slow_square(n):
+        time.sleep(0.01 * (5 - n))
+        return n * n
+
+    results, errors = for_each(slow_square, [1, 2, 3, 4], workers=4)
+
+    assert results == [1, 4, 9, 16]
+    assert errors == []
+
+
+def test_errors_are_collected_per_item():
+    def check(n):
+        if n % 2:
+            raise ValueError(n)
+        return n
+
+    results, errors = for_each(check, [1, 2, 3, 4], workers=2)
+
+    assert results == [None, 2, None, 4]
+    assert [item for item, error in errors] == [1, 3]
+    assert all(isinstance(error, ValueError) for item, error in errors)
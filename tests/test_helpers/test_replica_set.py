@@ -0,0 +1,104 @@
+from tyr.helpers import (ReplicaSetStatus, ReplicaSetWatcher, SyncProgress,
+                         has_primary, healthy, member_in_state, member_absent,
+                         primary_other_than)
+from tyr.servers.exceptions import ReplicaSetWaitTimeout
+from nose.tools import raises
+import datetime
+
+
+def status(*states):
+    return {
+        'ok': 1,
+        'members': [{'name': 'mongo-{i}:27018'.format(i=i), 'stateStr': state}
+                    for i, state in enumerate(states)]
+    }
+
+
+def test_conditions():
+    assert not has_primary({})
+    assert has_primary(status('SECONDARY', 'PRIMARY'))
+    assert healthy(status('PRIMARY', 'SECONDARY', 'ARBITER'))
+    assert not healthy(status('PRIMARY', 'STARTUP2', 'ARBITER'))
+    assert member_in_state('mongo-1', 'SECONDARY')(status('PRIMARY',
+                                                          'SECONDARY'))
+    assert not member_in_state('mongo-2', 'SECONDARY')(status('PRIMARY',
+                                                              'SECONDARY'))
+    assert primary_other_than('mongo-0')(status('SECONDARY', 'PRIMARY'))
+    assert not primary_other_than('mongo-0:27018')(status('PRIMARY'))
+    assert member_absent('mongo-2')(status('PRIMARY', 'SECONDARY'))
+    assert not member_absent('mongo-1')(status('PRIMARY', 'SECONDARY'))
+
+
+def test_status_indexes():
+    snapshot = ReplicaSetStatus(status('SECONDARY', 'PRIMARY', 'SECONDARY'))
+
+    assert snapshot.primary['name'] == 'mongo-1:27018'
+    assert len(snapshot.in_state('SECONDARY')) == 2
+    assert snapshot.in_state('ARBITER') == []
+    assert snapshot.member('mongo-2')['stateStr'] == 'SECONDARY'
+    assert snapshot['ok'] == 1
+
+
+def test_waits_for_condition():
+    snapshots = [{}, status('STARTUP'), status('PRIMARY')]
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return snapshots[len(calls) - 1]
+
+    watcher = ReplicaSetWatcher(fetch, interval=0.001)
+
+    assert watcher.wait_for_primary() == status('PRIMARY')
+    assert len(calls) == 3
+
+
+@raises(ReplicaSetWaitTimeout)
+def test_times_out():
+    watcher = ReplicaSetWatcher(lambda: status('SECONDARY'), interval=0.01,
+                                timeout=0.05)
+    watcher.wait_for_primary()
+
+
+def cloning(copied, to_copy):
+    syncing = status('PRIMARY', 'STARTUP2')
+    syncing['initialSyncStatus'] = {
+        'databases': {
+            'databasesCloned': 0,
+            'hudl': {
+                'collections': 2,
+                'clonedCollections': 1,
+                'hudl.users': {'documentsToCopy': to_copy,
+                               'documentsCopied': copied}
+            }
+        }
+    }
+    return syncing
+
+
+def test_sync_progress_estimates_time_remaining():
+    progress = SyncProgress('mongo-1', total_bytes=1000)
+
+    progress.update(cloning(100, 1000), now=0)
+    assert progress.eta is None
+
+    progress.update(cloning(300, 1000), now=10)
+    assert progress.rate == 20
+    assert progress.eta == 35
+    assert progress.collections == (1, 2)
+    assert '30% (300 documents of 1000 documents)' in progress.describe()
+
+    # Members without initial sync counters are sized with dbStats
+    progress = SyncProgress('mongo-1', total_bytes=1000)
+    progress.update(status('PRIMARY', 'STARTUP2'), 500, now=0)
+    assert progress.unit == 'bytes' and progress.total == 1000
+
+    now = datetime.datetime(2016, 1, 1)
+    catching_up = status('PRIMARY', 'RECOVERING')
+    catching_up['members'][0]['optimeDate'] = now
+    catching_up['members'][1]['optimeDate'] = now - datetime.timedelta(
+        seconds=60)
+
+    progress.update(catching_up, now=20)
+    assert progress.lag == 60
+    assert progress.eta is None
@@ -0,0 +1,104 @@
+from boto.exception import BotoServerError
+from nose.tools import raises
+from tyr.helpers import Throttle, TokenBucket
+import time
+
+THROTTLED = ('<Response><Errors><Error><Code>RequestLimitExceeded</Code>'
+             '</Error></Errors></Response>')
+
+
+class Request(object):
+
+    host = 'ec2.us-east-1.amazonaws.com'
+    port = 443
+
+
+class Response(object):
+
+    reason = 'Service Unavailable'
+
+    def __init__(self, status, body=''):
+        self.status = status
+        self.body = body
+
+    def read(self):
+        return self.body
+
+    def getheader(self, name):
+        return None
+
+
+class HTTPConnection(object):
+
+    def __init__(self, response):
+        self.response = response
+
+    def request(self, method, path, body, headers):
+        pass
+
+    def getresponse(self):
+        return self.response
+
+
+class Connection(object):
+
+    host = 'ec2.us-east-1.amazonaws.com'
+    is_secure = True
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.sent = 0
+        self.pooled = []
+
+    def put_http_connection(self, host, port, is_secure, connection):
+        self.pooled.append(connection)
+
+    def _mexe(self, request, sender=None, override_num_retries=None,
+              retry_handler=None):
+        self.sent += 1
+        response = sender(HTTPConnection(self.responses.pop(0)), 'POST', '/',
+                          '', {})
+
+        if retry_handler(response, 0, 0):
+            raise AssertionError('boto should not be asked to retry')
+
+        return response
+
+
+def test_bucket_limits_rate():
+    bucket = TokenBucket(rate=100, burst=2)
+
+    start = time.time()
+    for _ in range(4):
+        bucket.acquire()
+
+    assert time.time() - start >= 0.015
+
+
+def test_throttled_call_retried():
+    throttle = Throttle(base=0.001)
+    connection = throttle.instrument(Connection([Response(503, THROTTLED),
+                                                 Response(200)]))
+
+    assert connection._mexe(Request()).status == 200
+    assert connection.sent == 2
+
+    # The throttled attempt's connection went back to the pool
+    assert len(connection.pooled) == 1
+
+
+def test_retries_exhausted():
+    throttle = Throttle(retries=1, base=0.001)
+    connection = throttle.instrument(Connection([Response(400, THROTTLED)] *
+                                                3))
+
+    assert connection._mexe(Request()).status == 400
+    assert connection.sent == 2
+
+
+@raises(BotoServerError)
+def test_server_errors_raised_once_retries_exhausted():
+    throttle = Throttle(retries=1, base=0.001)
+    connection = throttle.instrument(Connection([Response(500)] * 3))
+
+    connection._mexe(Request())
@@ -0,0 +1,40 @@
+from tyr.helpers import Tracer
+
+
+def test_spans_nest():
+    tracer = Tracer()
+
+    with tracer.span('autorun', server='MongoDataNode') as outer:
+        with tracer.span('launch') as inner:
+            inner.set(instance='i-12345678')
+
+    assert inner.parent_id == outer.id
+    assert outer.parent_id is None
+    assert inner.attributes == {'instance': 'i-12345678'}
+    assert outer.end >= inner.end
+
+
+def test_chrome_export():
+    tracer = Tracer(enabled=True)
+
+    @tracer.traced('ssh', host='mongo-1')
+    def run():
+        pass
+
+    run()
+
+    events = tracer.to_chrome()['traceEvents']
+    complete = [event for event in events if event['ph'] == 'X']
+
+    assert len(complete) == 1
+    assert complete[0]['name'] == 'ssh'
+    assert complete[0]['args'] == {'host': 'mongo-1'}
+
+
+def test_spans_kept_only_when_enabled():
+    tracer = Tracer()
+
+    with tracer.span('ssh') as span:
+        assert tracer.current is span
+
+    assert tracer.spans == []
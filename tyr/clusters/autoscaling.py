@@ -2,7 +2,8 @@ from boto.ec2.blockdevicemapping import BlockDeviceType, BlockDeviceMapping
 from boto.ec2.autoscale import LaunchConfiguration
 from boto.ec2.autoscale import AutoScalingGroup
 from boto.ec2.autoscale import Tag
-import boto.ec2
+from tyr.helpers import (api_account, connection_registry, describe_cache,
+                         tracer)
 import logging
 
 
@@ -64,8 +65,8 @@ class AutoScaler(object):
 
     def establish_autoscale_connection(self):
         try:
-            self.conn = boto.ec2.autoscale.connect_to_region(
-                self.node_obj.region)
+            self.conn = connection_registry.get('autoscale',
+                                                self.node_obj.region)
             self.log.info('Established connection to autoscale')
         except:
             raise
@@ -77,7 +78,7 @@ class AutoScaler(object):
         self.log.info("Attempting to connect to EC2")
 
         try:
-            self.ec2 = boto.ec2.connect_to_region(self.node_obj.region)
+            self.ec2 = connection_registry.get('ec2', self.node_obj.region)
             self.log.info('Established connection to EC2')
         except Exception as e:
             self.log.error(str(e))
@@ -93,7 +94,10 @@ class AutoScaler(object):
             volume = BlockDeviceMapping()
 
             # Check the OS type, if its windows we use sda, linux: xvda
-            images = self.ec2.get_all_images(image_ids=[self.node_obj.ami])
+            images = describe_cache.get(self.node_obj.region,
+                                        ('images', self.node_obj.ami),
+                                        lambda: self.ec2.get_all_images(
+                                            image_ids=[self.node_obj.ami]))
             image = images[0]
 
             if image.platform is None:
@@ -158,6 +162,8 @@ class AutoScaler(object):
             self.log.info('Autoscaling group {g} already exists.'
                           .format(g=self.autoscaling_group))
 
+    @api_account.accounted
+    @tracer.traced('autoscaling')
     def autorun(self):
         self.establish_autoscale_connection()
         self.establish_ec2_connection()
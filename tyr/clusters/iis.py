@@ -1,6 +1,7 @@
 import logging
 from tyr.servers.iis import IISNode
 from tyr.clusters.autoscaling import AutoScaler
+from tyr.helpers import api_account, tracer
 
 
 class IISCluster():
@@ -99,7 +100,9 @@ class IISCluster():
 
     def provision(self):
         self.log.info('Provisioning IISCluster')
-        self.node.configure()
+
+        with tracer.span('configure', server='IISNode'):
+            self.node.configure()
 
         self.log.info('Creating autoscaler')
         self.autoscaler.autorun()
@@ -107,5 +110,7 @@ class IISCluster():
     def baked(self):
         return False
 
+    @api_account.accounted
+    @tracer.traced('cluster')
     def autorun(self):
         self.provision()
@@ -1,5 +1,9 @@
 import logging
 from tyr.servers.mongo import MongoDataNode, MongoArbiterNode
+from tyr.servers.exceptions import ChefRunFailed, ClusterProvisioningFailed
+from tyr.helpers import (ChangeTracker, ReplicaSetWatcher, api_account,
+                         for_each, tracer)
+import threading
 import time
 import json
 
@@ -22,9 +26,11 @@ class MongoCluster(object):
                  replica_set=None, security_groups=None,
                  block_devices=None, data_volume_size=None,
                  data_volume_iops=None, data_nodes=None,
-                 mongodb_version=None):
+                 mongodb_version=None, workers=8):
 
         self.nodes = []
+        self.dns_changes = None
+        self.bake_durations = {}
 
         self.instance_type = instance_type
         self.group = group
@@ -43,6 +49,7 @@ class MongoCluster(object):
         self.data_nodes = data_nodes
         self.mongodb_version = mongodb_version
         self.dns_zones = dns_zones
+        self.workers = workers
 
     def provision(self):
 
@@ -54,7 +61,9 @@ class MongoCluster(object):
 
             zones += zones
 
-        self.log.info('Provisioning MongoDB Data Nodes')
+        self.log.info('Configuring MongoDB Data Nodes')
+
+        nodes = []
 
         i = 0
 
@@ -76,9 +85,7 @@ class MongoCluster(object):
                                  data_volume_iops=self.data_volume_iops,
                                  mongodb_version=self.mongodb_version)
 
-            node.autorun()
-
-            self.nodes.append(node)
+            nodes.append(node)
 
         if (self.data_nodes % 2) == 0:
 
@@ -98,56 +105,149 @@ class MongoCluster(object):
                                     availability_zone=zones[i+1],
                                     mongodb_version=self.mongodb_version)
 
-            node.autorun()
+            nodes.append(node)
+
+        for node in nodes:
+            node.establish_logger()
+
+        self.log.info('Configuring {count} MongoDB Nodes'.format(
+                      count=len(nodes)))
+
+        def configure(node):
+
+            with tracer.span('configure', server=node.__class__.__name__):
+                node.configure()
+
+        self.for_each_node(configure, nodes)
+
+        self.log.info('Launching MongoDB Nodes')
+
+        MongoDataNode.launch_many(nodes, wait=True)
+
+        self.log.info('Routing MongoDB Nodes')
+
+        self.dns_changes = ChangeTracker(nodes[0].route53)
+        MongoDataNode.route_all(nodes, tracker=self.dns_changes)
+        self.dns_changes.start()
+
+        self.log.info('Provisioning MongoDB Nodes')
+
+        self.for_each_node(lambda node: node.bake(), nodes)
+
+        self.nodes.extend(nodes)
+
+    def for_each_node(self, function, nodes):
+        """
+        Apply `function` to every node concurrently, raising
+        ClusterProvisioningFailed with the error of each node that failed.
+        """
 
-            self.nodes.append(node)
+        results, errors = for_each(function, nodes, workers=self.workers)
 
-    def baked(self):
+        if errors:
+            # Nodes which failed before launching have not been named yet
+            errors = [(getattr(node, 'unique_name',
+                               '{type_} #{position}'.format(
+                                   type_=node.__class__.__name__,
+                                   position=nodes.index(node) + 1)), error)
+                      for node, error in errors]
 
-        return all([node.baked() for node in self.nodes])
+            for name, error in errors:
+                self.log.error('{node} failed: {error}'.format(
+                               node=name, error=error))
+
+            raise ClusterProvisioningFailed(errors)
+
+        return results
+
+    def baked(self, fail_fast=True):
+        """
+        Wait for the Chef runs on every node at once. With `fail_fast`, this
+        returns False as soon as any node fails rather than waiting on the
+        rest.
+        """
+
+        # Set once this returns, so waits still running after a failure
+        # stop instead of keeping their threads, and the process, alive
+        cancel = threading.Event()
+        lock = threading.Lock()
+
+        def bake_wait(node):
+
+            start = time.time()
+
+            try:
+                if not node.baked(cancel=cancel):
+                    raise ChefRunFailed('Chef Client was not successful')
+            finally:
+                with lock:
+                    if not cancel.is_set():
+                        self.bake_durations[node.hostname] = (time.time() -
+                                                              start)
+
+        results, errors = for_each(bake_wait, self.nodes,
+                                   workers=self.workers, fail_fast=fail_fast)
+
+        with lock:
+            cancel.set()
+
+        failed = dict((node.hostname, error) for node, error in errors)
+
+        for node in self.nodes:
+            if node.hostname in failed:
+                self.log.error('{node} failed after {duration:.0f} seconds: '
+                               '{error}'.format(
+                                   node=node.hostname,
+                                   duration=self.bake_durations[node.hostname],
+                                   error=failed[node.hostname]))
+            elif node.hostname in self.bake_durations:
+                self.log.info('{node} baked in {duration:.0f} seconds'.format(
+                              node=node.hostname,
+                              duration=self.bake_durations[node.hostname]))
+            else:
+                self.log.warn('{node} was still baking'.format(
+                              node=node.hostname))
+
+        return not errors
 
     def status(self):
 
         self.log.info('Determining replica set status')
 
-        return self.nodes[0].run_mongo('rs.status()')
+        return self.nodes[0].admin.status()
 
     def initiate(self):
 
         self.log.info('Initiating replica set')
 
-        return self.nodes[0].run_mongo('rs.initiate()')
+        return self.nodes[0].admin.initiate()
 
     def add(self, node):
 
         self.log.info('Adding "{node}" to the replica set'.format(
                                     node=node.hostname))
 
-        template = 'rs.add(\'{node}:27018\')'
-
-        if node.__class__.__name__ == 'MongoArbiterNode':
-            template = 'rs.addArb(\'{node}:27018\')'
+        arbiter = node.__class__.__name__ == 'MongoArbiterNode'
 
-        return self.nodes[0].run_mongo(template.format(node=node.hostname))
+        return self.nodes[0].admin.add_member(
+            '{node}:27018'.format(node=node.hostname), arbiter=arbiter)
 
     def add_all(self):
 
         for node in self.nodes[1:]:
             self.add(node)
 
+    @api_account.accounted
+    @tracer.traced('cluster')
     def autorun(self):
 
         self.provision()
         if self.baked():
+            self.log.info('Waiting for DNS records to propagate')
+            self.dns_changes.wait()
+
             self.initiate()
 
-            while True:
-                try:
-                    if len(self.status()['members']) > 0:
-                        if self.status()['members'][0]['stateStr'] \
-                          == 'PRIMARY':
-                            break
-                except KeyError:
-                    pass
+            ReplicaSetWatcher(self.status).wait_for_primary()
 
             self.add_all()
@@ -1,6 +1,7 @@
 import logging
 from tyr.servers.nginx import NginxServer
 from tyr.clusters.autoscaling import AutoScaler
+from tyr.helpers import api_account, tracer
 
 
 class NginxCluster():
@@ -90,7 +91,9 @@ class NginxCluster():
                            subnet_id=self.node_subnet)
 
         node.establish_logger()
-        node.configure()
+
+        with tracer.span('configure', server='NginxServer'):
+            node.configure()
 
         self.log.info('Creating autoscaler')
         auto = AutoScaler(launch_configuration=self.launch_configuration,
@@ -111,5 +114,7 @@ class NginxCluster():
     def baked(self):
         return False
 
+    @api_account.accounted
+    @tracer.traced('cluster')
     def autorun(self):
         self.provision()
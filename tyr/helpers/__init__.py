@@ -2,3 +2,22 @@
 # -*- coding: utf8 -*-
 
 from tyr.helpers.data_file import data_file
+from tyr.helpers.tracing import Tracer, tracer
+from tyr.helpers.throttling import Throttle, TokenBucket, throttle
+from tyr.helpers.accounting import ApiAccount, api_account
+from tyr.helpers.connections import (ConnectionRegistry,
+                                     connection_registry)
+from tyr.helpers.cache import RegionCache, describe_cache
+from tyr.helpers.security_groups import SecurityGroupIndex
+from tyr.helpers.indexes import IndexAllocator, index_allocator
+from tyr.helpers.waiters import wait_for_instances
+from tyr.helpers.dns import ChangeBatch, ChangeTracker, wait_for_changes
+from tyr.helpers.iam import IAMReconciler, iam_reconciler
+from tyr.helpers.parallel import for_each
+from tyr.helpers.replica_set import (ReplicaSetStatus, ReplicaSetWatcher,
+                                     has_primary, healthy, members_in_states,
+                                     member_in_state, member_absent,
+                                     primary_other_than, responding,
+                                     optime_lag, SyncProgress)
+from tyr.helpers.ssh import SSHPool, ssh_pool
+from tyr.helpers.mongo_admin import MongoAdmin, mongo_admin
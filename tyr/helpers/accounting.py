@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from tyr.helpers.throttling import throttle
+from tyr.helpers.tracing import tracer
+from tyr.servers.exceptions import ApiBudgetExceeded
+import functools
+import logging
+import re
+import threading
+import time
+
+
+def operation(request):
+    """
+    The API operation of a boto request: the Action of query APIs such as
+    EC2 and IAM, or the method and resource path of REST APIs such as
+    Route53, with identifiers left out.
+    """
+
+    action = request.params.get('Action')
+
+    if action:
+        return action
+
+    path = request.path.split('?')[0].strip('/').split('/')[1:]
+    path = [part if re.match('^[a-z]+$', part) else '{id}' for part in path]
+
+    return '{method} /{path}'.format(method=request.method,
+                                     path='/'.join(path))
+
+
+class ApiAccount(object):
+    """
+    Counts and times the AWS API calls made through instrumented boto and
+    boto3 connections, by operation and by the phase of the build they
+    were made in. A call's phase is the innermost tracer span around it,
+    such as configure, launch or route.
+
+    With a `budget`, the call which takes a run past it logs a warning,
+    or with `enforce` raises ApiBudgetExceeded instead of being made.
+    """
+
+    def __init__(self, budget=None, enforce=False):
+
+        self.log = logging.getLogger('Tyr.Helpers.ApiAccount')
+
+        self.budget = budget
+        self.enforce = enforce
+
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+
+        with self.lock:
+            # (phase, operation): [calls, seconds, errors]
+            self.calls = {}
+            self.phases = []
+            self.started = 0
+            self.warned = False
+
+    def set_budget(self, budget, enforce=False):
+
+        self.budget = budget
+        self.enforce = enforce
+
+    @property
+    def phase(self):
+
+        span = tracer.current
+
+        return span.name if span is not None else 'other'
+
+    def charge(self, name):
+        """
+        Count a call as it starts, holding it to the budget.
+        """
+
+        with self.lock:
+            self.started += 1
+            over = self.budget is not None and self.started > self.budget
+            warn = over and not self.warned and not self.enforce
+
+            if over and self.enforce:
+                self.started -= 1
+            elif warn:
+                self.warned = True
+
+        if over and self.enforce:
+            raise ApiBudgetExceeded(
+                'The budget of {budget} AWS API calls is spent; refusing to '
+                'call {operation}'.format(budget=self.budget,
+                                          operation=name))
+
+        if warn:
+            self.log.warn('The budget of {budget} AWS API calls is spent, '
+                          'at {operation} during {phase}'.format(
+                              budget=self.budget, operation=name,
+                              phase=self.phase))
+
+    def record(self, phase, name, elapsed, failed=False):
+
+        with self.lock:
+            if phase not in self.phases:
+                self.phases.append(phase)
+
+            entry = self.calls.setdefault((phase, name), [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += elapsed
+
+            if failed:
+                entry[2] += 1
+
+    def instrument(self, connection):
+        """
+        Account for the calls made through a boto connection or a boto3
+        client, and hold them to the shared rate limits, returning it.
+        """
+
+        if getattr(connection, 'tyr_accounted', False):
+            return connection
+
+        if hasattr(connection, 'meta'):
+            self.instrument_client(connection)
+        else:
+            self.instrument_connection(connection)
+
+        connection.tyr_accounted = True
+
+        # Every attempt the throttle makes is counted as a call of its own
+        return throttle.instrument(connection)
+
+    def instrument_connection(self, connection):
+
+        account = self
+        service = connection.host.split('.')[0]
+
+        def mexe(request, *args, **kwargs):
+
+            name = '{service}:{operation}'.format(
+                service=service, operation=operation(request))
+            phase = account.phase
+
+            account.charge(name)
+
+            start = time.time()
+            failed = True
+
+            try:
+                # Looked up on each call, so boto's own class is used
+                response = type(connection)._mexe(connection, request,
+                                                  *args, **kwargs)
+                failed = False
+                return response
+            finally:
+                account.record(phase, name, time.time() - start, failed)
+
+        connection._mexe = mexe
+
+    def instrument_client(self, client):
+
+        service = client.meta.service_model.endpoint_prefix
+
+        def before(model, context, **kwargs):
+
+            name = '{service}:{operation}'.format(service=service,
+                                                  operation=model.name)
+
+            context['tyr_account'] = (name, self.phase, time.time())
+
+            self.charge(name)
+
+        def after(http_response, context, **kwargs):
+
+            name, phase, start = context['tyr_account']
+
+            self.record(phase, name, time.time() - start,
+                        failed=http_response.status_code >= 400)
+
+        client.meta.events.register('before-call', before)
+        client.meta.events.register('after-call', after)
+
+    @property
+    def total(self):
+
+        with self.lock:
+            return sum(entry[0] for entry in self.calls.values())
+
+    def totals(self, index):
+
+        totals = {}
+
+        with self.lock:
+            for key, (calls, seconds, errors) in self.calls.items():
+                entry = totals.setdefault(key[index], [0, 0.0, 0])
+                entry[0] += calls
+                entry[1] += seconds
+                entry[2] += errors
+
+        return totals
+
+    def by_phase(self):
+
+        return self.totals(0)
+
+    def by_operation(self):
+
+        return self.totals(1)
+
+    def summary(self):
+
+        row = '{0:<16} {1:<40} {2:>6} {3:>8} {4:>6}'
+
+        lines = [row.format('Phase', 'Operation', 'Calls', 'Seconds',
+                            'Errors')]
+
+        with self.lock:
+            calls = dict(self.calls)
+            phases = list(self.phases)
+
+        for phase in phases:
+            for (_, name), (count, seconds, errors) in sorted(
+                    (key, entry) for key, entry in calls.items()
+                    if key[0] == phase):
+                lines.append(row.format(phase, name, count,
+                                        '{0:.3f}'.format(seconds), errors))
+
+        lines.append(row.format(
+            'total', '', sum(entry[0] for entry in calls.values()),
+            '{0:.3f}'.format(sum(entry[1] for entry in calls.values())),
+            sum(entry[2] for entry in calls.values())))
+
+        return '\n'.join(lines)
+
+    def report(self):
+
+        if self.total == 0:
+            return
+
+        self.log.info('AWS API calls:\n{summary}'.format(
+                      summary=self.summary()))
+
+    def accounted(self, method):
+        """
+        Decorate an autorun method so a run which is not part of another,
+        such as a subclass's autorun or a cluster build, starts with a
+        clean account and reports it once finished.
+        """
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+
+            depth = getattr(self.local, 'depth', 0)
+
+            if depth > 0 or tracer.current is not None:
+                return method(*args, **kwargs)
+
+            self.reset()
+            self.local.depth = 1
+
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.local.depth = 0
+                self.report()
+
+        return wrapper
+
+
+api_account = ApiAccount()
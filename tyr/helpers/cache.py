@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+import threading
+import time
+
+
+class RegionCache(object):
+    """
+    A TTL cache for the results of AWS describe calls, keyed by region and
+    lookup. Values are fetched at most once per TTL, even when several
+    servers are configured at the same time.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.entries = {}
+        self.locks = {}
+        self.lock = threading.RLock()
+
+    def cached(self, name):
+
+        with self.lock:
+            entry = self.entries.get(name)
+
+        if entry is not None and (time.time() - entry[0]) < self.ttl:
+            return entry
+
+        return None
+
+    def get(self, region, key, fetch):
+
+        name = (region, key)
+        entry = self.cached(name)
+
+        if entry is not None:
+            return entry[1]
+
+        with self.lock:
+            lock = self.locks.setdefault(name, threading.RLock())
+
+        # Only lookups of the same key wait for the one in flight
+        with lock:
+            entry = self.cached(name)
+
+            if entry is not None:
+                return entry[1]
+
+            value = fetch()
+
+            with self.lock:
+                self.entries[name] = (time.time(), value)
+
+            return value
+
+    def invalidate(self, region=None, key=None):
+
+        with self.lock:
+            for cached in self.entries.keys():
+                if region is not None and cached[0] != region:
+                    continue
+                if key is not None and cached[1] != key:
+                    continue
+
+                del self.entries[cached]
+
+
+describe_cache = RegionCache()
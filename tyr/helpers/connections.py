@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from tyr.helpers.accounting import api_account
+from tyr.servers.exceptions import RegionDoesNotExist
+import boto
+import boto.ec2
+import boto.ec2.autoscale
+import boto.route53
+import boto.vpc
+import boto3
+import logging
+import threading
+
+CONNECT = {
+    'ec2': boto.ec2.connect_to_region,
+    'vpc': boto.vpc.connect_to_region,
+    'autoscale': boto.ec2.autoscale.connect_to_region,
+    'route53': boto.route53.connect_to_region,
+    # IAM is global, so there is one connection whatever the region
+    'iam': lambda region: boto.connect_iam()
+}
+
+
+class ConnectionRegistry(object):
+    """
+    Hands out one boto connection or boto3 client per service and region
+    for the whole process, so servers configured one after another or at
+    the same time share their HTTP connections and resolved credentials.
+    Every connection is instrumented for API accounting and throttling as
+    it is made.
+    """
+
+    def __init__(self, connect=None):
+
+        self.log = logging.getLogger('Tyr.Helpers.ConnectionRegistry')
+
+        self.connect = dict(CONNECT)
+        self.connect.update(connect or {})
+
+        self.lock = threading.Lock()
+        self.connections = {}
+
+    def reset(self):
+
+        with self.lock:
+            self.connections = {}
+
+    def lookup(self, key, connect):
+
+        # Connecting can resolve credentials from the instance metadata, so
+        # it is done once under the lock rather than by every thread
+        with self.lock:
+            try:
+                return self.connections[key]
+            except KeyError:
+                pass
+
+            connection = connect()
+
+            if connection is None:
+                raise RegionDoesNotExist(
+                    'No {service} endpoint in region {region}'.format(
+                        service=key[1], region=key[2]))
+
+            self.log.debug('Connected to {service} in {region}'.format(
+                           service=key[1], region=key[2]))
+
+            connection = api_account.instrument(connection)
+            self.connections[key] = connection
+
+            return connection
+
+    def get(self, service, region='us-east-1'):
+        """
+        The boto connection to `service` (ec2, vpc, autoscale, route53 or
+        iam) in `region`.
+        """
+
+        if service == 'iam':
+            region = None
+
+        return self.lookup(('boto', service, region),
+                           lambda: self.connect[service](region))
+
+    def client(self, service, region=None):
+        """
+        The boto3 client for `service` in `region`, or the configured
+        default region.
+        """
+
+        return self.lookup(('boto3', service, region),
+                           lambda: boto3.client(service, region_name=region))
+
+
+connection_registry = ConnectionRegistry()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from tyr.helpers.tracing import tracer
+from tyr.servers.exceptions import DNSChangeTimeout
+from boto.route53.record import ResourceRecordSets
+from concurrent.futures import Future
+import logging
+import threading
+import time
+
+
+class ChangeBatch(object):
+    """
+    Collects Route53 records for any number of servers and writes them as
+    one UPSERT ChangeResourceRecordSets request per hosted zone.
+    """
+
+    # Route53 accepts at most 1000 resource records per request
+    MAX_CHANGES = 500
+
+    def __init__(self, conn, comment='Routed by Tyr'):
+
+        self.log = logging.getLogger('Tyr.Helpers.ChangeBatch')
+
+        self.conn = conn
+        self.comment = comment
+        self.zones = {}
+
+    def upsert(self, zone_id, name, type_, value, ttl=60):
+
+        records = self.zones.setdefault(zone_id, {})
+
+        # A later value for the same record replaces an earlier one; a
+        # batch may not change a record set twice
+        records[(name, type_)] = {
+            'name': name,
+            'type': type_,
+            'value': value,
+            'ttl': ttl
+        }
+
+    def __len__(self):
+
+        return sum(len(records) for records in self.zones.values())
+
+    def commit(self):
+        """
+        Submit the batch, returning the Route53 change IDs.
+        """
+
+        change_ids = []
+
+        for zone_id, records in self.zones.items():
+            records = records.values()
+
+            for start in range(0, len(records), self.MAX_CHANGES):
+                chunk = records[start:start + self.MAX_CHANGES]
+
+                changes = ResourceRecordSets(self.conn, zone_id,
+                                             comment=self.comment)
+
+                for record in chunk:
+                    change = changes.add_change('UPSERT', record['name'],
+                                                record['type'],
+                                                ttl=record['ttl'])
+                    change.add_value(record['value'])
+
+                response = changes.commit()
+                info = response['ChangeResourceRecordSetsResponse']
+                change_id = info['ChangeInfo']['Id'].replace('/change/', '')
+
+                self.log.info('Submitted {count} DNS records to zone {zone} '
+                              'as change {change}'.format(count=len(chunk),
+                                                          zone=zone_id,
+                                                          change=change_id))
+
+                change_ids.append(change_id)
+
+        self.zones = {}
+
+        return change_ids
+
+
+def change_status(conn, change_id):
+
+    response = conn.get_change(change_id)
+
+    return response['GetChangeResponse']['ChangeInfo']['Status']
+
+
+class ChangeTracker(object):
+    """
+    Tracks pending Route53 changes until they are INSYNC. Every pending
+    change is checked on each tick, and the interval between ticks backs
+    off. Each change resolves a future, so callers can carry on while the
+    tracker polls in the background.
+    """
+
+    def __init__(self, conn, interval=5, max_interval=30, backoff=1.5,
+                 timeout=900):
+
+        self.log = logging.getLogger('Tyr.Helpers.ChangeTracker')
+
+        self.conn = conn
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.futures = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, change_ids):
+
+        futures = []
+
+        with self.lock:
+            for change_id in change_ids:
+                if change_id not in self.futures:
+                    self.futures[change_id] = Future()
+                    self.pending[change_id] = self.futures[change_id]
+
+                futures.append(self.futures[change_id])
+
+        return futures
+
+    def poll(self):
+
+        with self.lock:
+            pending = self.pending.items()
+
+        for change_id, future in pending:
+            if change_status(self.conn, change_id) != 'INSYNC':
+                continue
+
+            self.log.info('DNS change {change} is in sync'.format(
+                          change=change_id))
+
+            with self.lock:
+                self.pending.pop(change_id, None)
+
+            future.set_result(change_id)
+
+    def run(self):
+
+        interval = self.interval
+        deadline = time.time() + self.timeout
+
+        while self.pending:
+            self.poll()
+
+            if not self.pending:
+                break
+
+            if time.time() + interval > deadline:
+                error = DNSChangeTimeout(
+                    'Timed out waiting for DNS changes {changes}'.format(
+                        changes=', '.join(self.pending.keys())))
+
+                with self.lock:
+                    pending = self.pending.values()
+                    self.pending = {}
+
+                for future in pending:
+                    future.set_exception(error)
+
+                raise error
+
+            self.log.debug('Waiting for {count} DNS changes to propagate'
+                           .format(count=len(self.pending)))
+
+            time.sleep(interval)
+            interval = min(interval * self.backoff, self.max_interval)
+
+    def run_in_background(self, span):
+
+        with tracer.adopt(span):
+            try:
+                self.run()
+            except Exception as e:
+                self.log.error(str(e))
+
+    def start(self):
+        """
+        Poll in a background thread; the futures returned by add() are
+        resolved as the changes complete.
+        """
+
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        self.thread = threading.Thread(target=self.run_in_background,
+                                       args=(tracer.current,),
+                                       name='Tyr-ChangeTracker')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wait(self):
+
+        if self.thread is not None:
+            self.thread.join()
+
+        self.run()
+
+        for future in self.futures.values():
+            future.result()
+
+
+def wait_for_changes(conn, change_ids):
+
+    tracker = ChangeTracker(conn)
+    tracker.add(change_ids)
+    tracker.wait()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from tyr.helpers.connections import connection_registry
+from tyr.helpers.tracing import tracer
+import json
+import logging
+import threading
+import urllib
+
+
+class IAMReconciler(object):
+    """
+    Brings IAM roles in line with the policies tyr expects of them.
+
+    The current inline and attached policies of a role are fetched
+    concurrently and compared locally, and only policies which are missing
+    or differ are written. Each role and policy is reconciled at most once
+    per process, so servers sharing a role do not repeat the work.
+
+    Reads go through the process-wide IAM connection on a pool of workers
+    which lives as long as the reconciler. boto takes a pooled HTTP
+    connection for each request, so one connection is safely used from
+    every worker at once.
+    """
+
+    def __init__(self, workers=8):
+
+        self.log = logging.getLogger('Tyr.Helpers.IAMReconciler')
+
+        self.workers = workers
+        self.executor = None
+
+        self.account_id = None
+        self.roles = set()
+        self.reconciled = set()
+
+        # Guards the sets above; each role has a lock of its own, held
+        # while it is reconciled
+        self.lock = threading.Lock()
+        self.role_locks = {}
+
+    @property
+    def worker_connection(self):
+
+        return connection_registry.get('iam')
+
+    @property
+    def pool(self):
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+            return self.executor
+
+    def adopted(self, span, method, *args):
+
+        # Lookups made on the pool's threads belong to the caller's span
+        with tracer.adopt(span):
+            return method(*args)
+
+    def not_found(self, e):
+
+        return '404 Not Found' in str(e)
+
+    def role_lock(self, role):
+
+        with self.lock:
+            return self.role_locks.setdefault(role, threading.Lock())
+
+    def ensure_role(self, conn, role):
+
+        with self.lock:
+            if role in self.roles:
+                return
+
+        try:
+            conn.get_instance_profile(role)
+        except Exception as e:
+            if not self.not_found(e):
+                self.log.error(str(e))
+                raise e
+
+            conn.create_instance_profile(role)
+            self.log.info('Created IAM Profile {profile}'.format(
+                          profile=role))
+
+        try:
+            response = conn.get_role(role)
+        except Exception as e:
+            if not self.not_found(e):
+                self.log.error(str(e))
+                raise e
+
+            response = conn.create_role(role)
+            self.log.info('Created IAM Role {role}'.format(role=role))
+            conn.add_role_to_instance_profile(role, role)
+            self.log.info('Attached Role {role} to Profile {profile}'.format(
+                          role=role, profile=role))
+
+        with self.lock:
+            if self.account_id is None:
+                arn = response.role.arn
+                self.account_id = arn[arn.find('::')+2:arn.rfind(':')]
+
+                self.log.info('Using AWS account {account}'.format(
+                              account=self.account_id))
+
+            self.roles.add(role)
+
+    def existing_inline_policies(self, role):
+
+        response = self.worker_connection.list_role_policies(role)
+        response = response['list_role_policies_response']
+        result = response['list_role_policies_result']
+
+        return result['policy_names']
+
+    def existing_managed_policies(self, role):
+
+        conn = self.worker_connection
+        response = conn.get_response('ListAttachedRolePolicies',
+                                     {'RoleName': role},
+                                     list_marker='AttachedPolicies')
+        response = response['list_attached_role_policies_response']
+        result = response['list_attached_role_policies_result']
+
+        return [policy['policy_arn'] for policy in result['attached_policies']]
+
+    def inline_policy(self, role, policy):
+
+        response = self.worker_connection.get_role_policy(role, policy)
+        response = response['get_role_policy_response']
+        document = response['get_role_policy_result']['policy_document']
+
+        return json.loads(urllib.unquote(document))
+
+    def managed_policy_arn(self, policy):
+
+        return 'arn:aws:iam::{account_id}:policy/{policy}'.format(
+            account_id=self.account_id, policy=policy)
+
+    def mark_reconciled(self, role, policy):
+
+        with self.lock:
+            self.reconciled.add((role, policy))
+
+    def reconcile(self, conn, role, inline_policies, managed_policies):
+        """
+        `inline_policies` maps policy names to their JSON documents and
+        `managed_policies` lists the names of customer managed policies to
+        attach.
+        """
+
+        with self.role_lock(role):
+            self.ensure_role(conn, role)
+
+            with self.lock:
+                inline = dict((name, document) for name, document
+                              in inline_policies.items()
+                              if (role, name) not in self.reconciled)
+
+                managed = [self.managed_policy_arn(policy)
+                           for policy in managed_policies]
+                managed = [arn for arn in managed
+                           if (role, arn) not in self.reconciled]
+
+            if not inline and not managed:
+                self.log.info('IAM Role {role} is already reconciled'.format(
+                              role=role))
+                return
+
+            pool = self.pool
+            parent = tracer.current
+
+            existing_inline = pool.submit(self.adopted, parent,
+                                          self.existing_inline_policies,
+                                          role)
+            existing_managed = pool.submit(self.adopted, parent,
+                                           self.existing_managed_policies,
+                                           role)
+
+            existing_inline = existing_inline.result()
+
+            self.log.info('Existing policies: {policies}'.format(
+                          policies=existing_inline))
+
+            current = dict((name, pool.submit(self.adopted, parent,
+                                              self.inline_policy, role,
+                                              name))
+                           for name in inline if name in existing_inline)
+            current = dict((name, future.result())
+                           for name, future in current.items())
+
+            existing_managed = existing_managed.result()
+
+            for name, document in inline.items():
+                if name not in current:
+                    self.log.info('Policy "{policy}" does not exist'.format(
+                                  policy=name))
+                elif json.loads(document) != current[name]:
+                    self.log.warn('Policy "{policy}" has been modified'
+                                  .format(policy=name))
+                else:
+                    self.log.info('Policy "{policy}" is accurate'.format(
+                                  policy=name))
+                    self.mark_reconciled(role, name)
+                    continue
+
+                try:
+                    conn.put_role_policy(role, name, document)
+                    self.log.info('Added policy "{policy}"'.format(
+                                  policy=name))
+                except Exception as e:
+                    self.log.error(str(e))
+                    raise e
+
+                self.mark_reconciled(role, name)
+
+            for arn in managed:
+                if arn not in existing_managed:
+                    conn.attach_role_policy(arn, role)
+                    self.log.info('Attached managed policy {policy} to role '
+                                  '{role}'.format(policy=arn, role=role))
+
+                self.mark_reconciled(role, arn)
+
+
+iam_reconciler = IAMReconciler()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from tyr.servers.exceptions import NoIndexAvailable
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+
+class IndexAllocator(object):
+    """
+    Hands out node name indexes for name prefixes such as
+    "s-monolith-mongo-rs1-use1c-".
+
+    Indexes in use are read from the Name tags of pending and running
+    instances with a single DescribeInstances call. Indexes handed out but
+    not yet tagged are recorded in a reservations file guarded by an
+    exclusive lock, so concurrent builds in this or other tyr processes
+    never pick the same name.
+    """
+
+    MAX_INDEX = 99
+
+    def __init__(self, path='~/.tyr/index-reservations.json', ttl=3600):
+
+        self.log = logging.getLogger('Tyr.Helpers.IndexAllocator')
+
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def locked(self, update):
+
+        directory = os.path.dirname(self.path)
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+
+        with self.lock:
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+                try:
+                    reservations = self.load()
+                    result = update(reservations)
+                    self.save(reservations)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        return result
+
+    def load(self):
+
+        try:
+            with open(self.path, 'r') as f:
+                reservations = json.load(f)
+        except (IOError, ValueError):
+            reservations = {}
+
+        now = time.time()
+
+        for prefix in reservations.keys():
+            for index, expires in reservations[prefix].items():
+                if expires < now:
+                    del reservations[prefix][index]
+
+            if not reservations[prefix]:
+                del reservations[prefix]
+
+        return reservations
+
+    def save(self, reservations):
+
+        path = self.path + '.tmp'
+
+        with open(path, 'w') as f:
+            json.dump(reservations, f)
+
+        os.rename(path, self.path)
+
+    def used_indexes(self, conn, prefixes):
+
+        filters = {
+            'tag:Name': [prefix + '*' for prefix in prefixes],
+            'instance-state-name': ['pending', 'running']
+        }
+
+        reservations = conn.get_all_instances(filters=filters)
+
+        used = dict((prefix, set()) for prefix in prefixes)
+
+        for reservation in reservations:
+            for instance in reservation.instances:
+                name = instance.tags.get('Name', '')
+
+                for prefix in prefixes:
+                    if not name.startswith(prefix):
+                        continue
+
+                    index = name[len(prefix):]
+
+                    if index.isdigit():
+                        used[prefix].add(int(index))
+
+        return used
+
+    def reserve(self, conn, counts):
+        """
+        Reserves indexes for several prefixes at once. `counts` maps each
+        name prefix to the number of indexes required; the result maps each
+        prefix to a list of zero-padded indexes.
+        """
+
+        def update(reservations):
+
+            # Queried under the lock, so an index another process reserves,
+            # tags and releases in the meantime is seen as used
+            used = self.used_indexes(conn, counts.keys())
+
+            allocated = {}
+            expires = time.time() + self.ttl
+
+            for prefix, count in counts.items():
+                reserved = reservations.setdefault(prefix, {})
+                taken = used[prefix] | set(int(i) for i in reserved.keys())
+
+                free = [i for i in range(1, self.MAX_INDEX + 1)
+                        if i not in taken]
+
+                if len(free) < count:
+                    raise NoIndexAvailable(
+                        'Unable to reserve {count} indexes for {prefix}'
+                        .format(count=count, prefix=prefix))
+
+                allocated[prefix] = []
+
+                for i in free[:count]:
+                    reserved[str(i)] = expires
+                    allocated[prefix].append('{index:02d}'.format(index=i))
+
+                self.log.info('Reserved indexes {indexes} for {prefix}'
+                              .format(indexes=allocated[prefix],
+                                      prefix=prefix))
+
+            return allocated
+
+        return self.locked(update)
+
+    def release(self, prefix, indexes):
+
+        def update(reservations):
+
+            reserved = reservations.get(prefix, {})
+
+            for index in indexes:
+                reserved.pop(str(int(index)), None)
+
+            if prefix in reservations and not reserved:
+                del reservations[prefix]
+
+        self.locked(update)
+
+
+index_allocator = IndexAllocator()
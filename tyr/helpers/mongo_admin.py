@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from tyr.helpers.ssh import ssh_pool
+from tyr.helpers.tracing import tracer
+from pymongo import MongoClient
+from pymongo.errors import AutoReconnect, OperationFailure
+import logging
+import threading
+
+
+class MongoAdmin(object):
+    """
+    Runs replica set administration commands against a single mongod
+    through the driver. By default the connection is carried over the
+    pooled SSH connection to the host, which is how the mongo shell used
+    to be reached; with `tunnel=False` the driver connects directly.
+
+    Failed commands return the server's reply, with ok set to 0, as the
+    shell did rather than raising.
+    """
+
+    def __init__(self, host, port=27018, tunnel=True, timeout=10):
+
+        self.log = logging.getLogger('Tyr.Helpers.MongoAdmin')
+
+        self.host = host
+        self.port = port
+        self.version_array = None
+
+        if tunnel:
+            address, port = 'localhost', ssh_pool.forward(host, port)
+        else:
+            address = host
+
+        # A single seed without a replica set name is a direct connection,
+        # so commands can be sent to secondaries and arbiters too
+        self.client = MongoClient(address, port, connect=False,
+                                  serverSelectionTimeoutMS=timeout * 1000,
+                                  socketTimeoutMS=60000)
+
+    def command(self, *args, **kwargs):
+
+        self.log.debug('Running {command} on {host}'.format(command=args[0],
+                                                            host=self.host))
+
+        try:
+            with tracer.span('mongo', host=self.host, command=args[0]):
+                return self.client.admin.command(*args, **kwargs)
+        except OperationFailure as e:
+            self.log.debug('{command} failed on {host}: {error}'.format(
+                           command=args[0], host=self.host, error=e))
+            return e.details
+
+    def version(self):
+
+        if self.version_array is None:
+            info = self.command('buildInfo')
+            self.version_array = tuple(info.get('versionArray', ()))
+
+        return self.version_array
+
+    def status(self, initial_sync=False):
+
+        # MongoDB 3.4 and later report per-collection cloning progress;
+        # older servers reject the option
+        if initial_sync and self.version() >= (3, 4):
+            status = self.command('replSetGetStatus', initialSync=1)
+
+            if status.get('ok'):
+                return status
+
+        return self.command('replSetGetStatus')
+
+    def data_size(self):
+        """
+        The uncompressed size, in bytes, of every replicated database.
+        """
+
+        databases = self.command('listDatabases').get('databases', [])
+
+        return sum(self.client[database['name']].command('dbStats')
+                   .get('dataSize', 0)
+                   for database in databases if database['name'] != 'local')
+
+    def is_master(self):
+
+        return self.command('isMaster')
+
+    def initiate(self):
+
+        # Without a configuration the server generates one for itself
+        return self.command('replSetInitiate')
+
+    def config(self):
+
+        # Unlike replSetGetConfig, this works on MongoDB 2.4 and 2.6
+        return self.client.local.system.replset.find_one()
+
+    def reconfig(self, config, force=False):
+
+        config['version'] += 1
+
+        return self.command('replSetReconfig', config, force=force)
+
+    def add_member(self, name, arbiter=False, hidden=False):
+
+        config = self.config()
+
+        member = {
+            '_id': max([m['_id'] for m in config['members']] + [-1]) + 1,
+            'host': name
+        }
+
+        if arbiter:
+            member['arbiterOnly'] = True
+        elif hidden:
+            member['priority'] = 0
+            member['hidden'] = True
+
+        config['members'].append(member)
+
+        return self.reconfig(config)
+
+    def remove_member(self, name):
+
+        config = self.config()
+        config['members'] = [m for m in config['members']
+                             if m['host'] != name]
+
+        return self.reconfig(config)
+
+    def step_down(self, seconds=60):
+
+        try:
+            return self.command('replSetStepDown', seconds)
+        except AutoReconnect:
+            # Older servers drop every connection as they step down
+            return {'ok': 1}
+
+    def sync_from(self, name):
+
+        return self.command('replSetSyncFrom', name)
+
+
+admins = {}
+admins_lock = threading.Lock()
+
+
+def mongo_admin(host, port=27018, tunnel=True):
+    """
+    The shared MongoAdmin for a host, so its connection pool is reused.
+    """
+
+    with admins_lock:
+        key = (host, port, tunnel)
+
+        if key not in admins:
+            admins[key] = MongoAdmin(host, port, tunnel=tunnel)
+
+        return admins[key]
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tyr.helpers.tracing import tracer
+
+
+def for_each(function, items, workers=8, fail_fast=False):
+    """
+    Call `function` with each of `items` on a pool of at most `workers`
+    threads.
+
+    Returns the results in the order of `items`, and a list of
+    `(item, exception)` pairs for the calls which raised. With `fail_fast`
+    this returns as soon as any call raises; calls which have not started
+    are cancelled and their results are None.
+    """
+
+    results = [None] * len(items)
+    errors = {}
+
+    if not items:
+        return results, []
+
+    parent = tracer.current
+
+    def call(item):
+
+        with tracer.adopt(parent):
+            return function(item)
+
+    pool = ThreadPoolExecutor(max_workers=min(workers, len(items)))
+
+    futures = dict((pool.submit(call, item), i)
+                   for i, item in enumerate(items))
+
+    try:
+        for future in as_completed(futures):
+            i = futures[future]
+
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                errors[i] = e
+
+                if fail_fast:
+                    break
+    finally:
+        for future in futures:
+            future.cancel()
+
+        # Calls already running cannot be interrupted; when failing fast
+        # they are left to finish in the background
+        pool.shutdown(wait=False)
+
+    return results, [(items[i], errors[i]) for i in sorted(errors)]
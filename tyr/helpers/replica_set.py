@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from tyr.servers.exceptions import ReplicaSetWaitTimeout
+import collections
+import datetime
+import logging
+import time
+
+
+def members(status):
+
+    try:
+        return status.get('members', [])
+    except AttributeError:
+        # The mongo shell output could not be parsed as JSON
+        return []
+
+
+def host(name):
+
+    return name.split(':')[0]
+
+
+def has_primary(status):
+
+    return any(member['stateStr'] == 'PRIMARY' for member in members(status))
+
+
+def primary_other_than(name):
+    """
+    A condition which holds once a member other than `name` is primary,
+    such as after `name` has stepped down.
+    """
+
+    def condition(status):
+
+        return any(member['stateStr'] == 'PRIMARY' and
+                   host(member['name']) != host(name)
+                   for member in members(status))
+
+    condition.__name__ = 'a primary other than {name}'.format(name=name)
+
+    return condition
+
+
+def member_absent(name):
+
+    def condition(status):
+
+        return (len(members(status)) > 0 and
+                all(host(member['name']) != host(name)
+                    for member in members(status)))
+
+    condition.__name__ = '{name} to leave the replica set'.format(name=name)
+
+    return condition
+
+
+def responding(reply):
+    """
+    The server answered a command, such as isMaster, successfully.
+    """
+
+    try:
+        return reply.get('ok') == 1
+    except AttributeError:
+        return False
+
+
+def members_in_states(*states):
+    """
+    A condition which holds once every member is in one of `states`.
+    """
+
+    def condition(status):
+
+        current = members(status)
+
+        return (len(current) > 0 and
+                all(member['stateStr'] in states for member in current))
+
+    condition.__name__ = 'all members {states}'.format(
+        states='/'.join(states))
+
+    return condition
+
+
+def healthy(status):
+    """
+    There is a primary and every other member is a secondary or arbiter.
+    """
+
+    return (has_primary(status) and
+            members_in_states('PRIMARY', 'SECONDARY', 'ARBITER')(status))
+
+
+def member_in_state(name, *states):
+    """
+    A condition which holds once the member `name`, given with or without
+    its port, is in one of `states`.
+    """
+
+    def condition(status):
+
+        for member in members(status):
+            if host(member['name']) == host(name):
+                return member['stateStr'] in states
+
+        return False
+
+    condition.__name__ = '{name} {states}'.format(name=name,
+                                                  states='/'.join(states))
+
+    return condition
+
+
+class ReplicaSetStatus(dict):
+    """
+    An rs.status() snapshot, with its members indexed by name and by state
+    once when it is taken.
+    """
+
+    def __init__(self, status):
+
+        super(ReplicaSetStatus, self).__init__(status or {})
+
+        self.taken = time.time()
+
+        self.by_name = {}
+        self.by_state = {}
+
+        for member in members(self):
+            self.by_name[member['name']] = member
+            self.by_state.setdefault(member['stateStr'], []).append(member)
+
+        primaries = self.by_state.get('PRIMARY', [])
+        self.primary = primaries[0] if primaries else None
+
+    @property
+    def age(self):
+
+        return time.time() - self.taken
+
+    def in_state(self, state):
+
+        return self.by_state.get(state, [])
+
+    def member(self, name):
+        """
+        Look up a member by name, with or without its port.
+        """
+
+        for member_name, member in self.by_name.items():
+            if host(member_name) == host(name):
+                return member
+
+        return None
+
+
+class ReplicaSetWatcher(object):
+    """
+    Waits for a replica set to reach a state. `status` is called for one
+    rs.status() snapshot per tick, and the interval between ticks backs off
+    up to `max_interval`. A `timeout` of None waits indefinitely.
+    """
+
+    def __init__(self, status, interval=2, max_interval=30, backoff=1.5,
+                 timeout=600):
+
+        self.log = logging.getLogger('Tyr.Helpers.ReplicaSetWatcher')
+
+        self.status = status
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def snapshot(self):
+
+        try:
+            return self.status()
+        except Exception as e:
+            # mongod may still be starting or electing
+            self.log.debug('Unable to retrieve the replica set status: '
+                           '{error}'.format(error=e))
+            return {}
+
+    def wait_until(self, condition, timeout=None, interval=None):
+        """
+        Wait until `condition` holds for a status snapshot, returning that
+        snapshot. `timeout` defaults to the watcher's own.
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+
+        interval = interval or self.interval
+        deadline = None if timeout is None else time.time() + timeout
+
+        description = condition.__name__.replace('_', ' ')
+
+        self.log.info('Waiting for {condition}'.format(condition=description))
+
+        while True:
+            status = self.snapshot()
+
+            if condition(status):
+                self.log.info('Replica set reached {condition}'.format(
+                              condition=description))
+                return status
+
+            if deadline is not None and time.time() + interval > deadline:
+                raise ReplicaSetWaitTimeout(
+                    'Timed out waiting for {condition}'.format(
+                        condition=description))
+
+            self.log.debug('Checking again in {interval:.0f} seconds'.format(
+                           interval=interval))
+
+            time.sleep(interval)
+            interval = min(interval * self.backoff, self.max_interval)
+
+    def wait_for_primary(self, timeout=None):
+
+        return self.wait_until(has_primary, timeout=timeout)
+
+    def wait_until_healthy(self, timeout=None):
+
+        return self.wait_until(healthy, timeout=timeout)
+
+    def wait_for_member(self, name, state, timeout=None):
+
+        return self.wait_until(member_in_state(name, state), timeout=timeout)
+
+
+def optime_lag(status, name):
+    """
+    How many seconds the member `name` is behind the primary, or None if
+    either optime is unknown.
+    """
+
+    primary = None
+    member = None
+
+    for candidate in members(status):
+        if candidate['stateStr'] == 'PRIMARY':
+            primary = candidate
+        if host(candidate['name']) == host(name):
+            member = candidate
+
+    try:
+        lag = primary['optimeDate'] - member['optimeDate']
+    except (TypeError, KeyError):
+        return None
+
+    return lag.total_seconds()
+
+
+class SyncProgress(object):
+    """
+    Follows a member through its initial sync and the catch up which
+    follows it, estimating throughput and the time remaining from the
+    samples seen so far.
+
+    While cloning, progress is the documents copied against those to copy,
+    from the initial sync status of MongoDB 3.4 and later. Older members
+    report no such counters, so the data the member holds is measured
+    against the primary's instead, both as dbStats dataSize. Once cloning
+    is done, progress is the member's optime lag.
+    """
+
+    def __init__(self, name, total_bytes=None, window=10):
+
+        self.name = name
+        self.total_bytes = total_bytes
+        self.samples = collections.deque(maxlen=window)
+
+        self.state = None
+        self.lag = None
+        self.copied = None
+        self.total = None
+        self.unit = None
+        self.collections = None
+        self.rate = None
+        self.eta = None
+
+    def documents(self, status):
+        """
+        Documents copied and to copy by the initial sync, or None.
+        """
+
+        databases = status.get('initialSyncStatus', {}).get('databases', {})
+        databases = [d for d in databases.values() if isinstance(d, dict)]
+
+        if not databases:
+            return None
+
+        self.collections = (
+            sum(d.get('clonedCollections', 0) for d in databases),
+            sum(d.get('collections', 0) for d in databases))
+
+        collections = [c for d in databases for c in d.values()
+                       if isinstance(c, dict) and 'documentsToCopy' in c]
+
+        if not collections:
+            return None
+
+        return (sum(c.get('documentsCopied', 0) for c in collections),
+                sum(c['documentsToCopy'] for c in collections))
+
+    def update(self, status, copied_bytes=None, now=None):
+        """
+        `copied_bytes` is the member's own data size, used when `status`
+        carries no initial sync counters.
+        """
+
+        if now is None:
+            now = time.time()
+
+        member = None
+
+        for candidate in members(status):
+            if host(candidate['name']) == host(self.name):
+                member = candidate
+
+        self.state = member['stateStr'] if member else None
+        self.lag = optime_lag(status, self.name)
+        self.copied = None
+        self.total = None
+        self.unit = None
+        self.collections = None
+
+        if self.state == 'STARTUP2':
+            documents = self.documents(status)
+
+            if documents is not None:
+                self.copied, self.total = documents
+                self.unit = 'documents'
+            elif copied_bytes is not None:
+                self.copied, self.total = copied_bytes, self.total_bytes
+                self.unit = 'bytes'
+
+            value, remaining = self.copied, None
+
+            if self.copied is not None and self.total:
+                remaining = max(self.total - self.copied, 0)
+        else:
+            # Catching up: progress is the lag shrinking
+            value = None if self.lag is None else -self.lag
+            remaining = self.lag
+
+        # Rates are only measured within one phase of the sync
+        if value is None or (self.samples and
+                             self.samples[-1][1:3] != (self.state,
+                                                       self.unit)):
+            self.samples.clear()
+
+        if value is not None:
+            self.samples.append((now, self.state, self.unit, value))
+
+        self.rate = None
+        self.eta = None
+
+        if len(self.samples) > 1:
+            first, last = self.samples[0], self.samples[-1]
+            elapsed = last[0] - first[0]
+
+            if elapsed > 0 and last[3] > first[3]:
+                self.rate = float(last[3] - first[3]) / elapsed
+
+                if remaining is not None:
+                    self.eta = remaining / self.rate
+
+        return self
+
+    def interval(self, minimum=10, maximum=300):
+        """
+        Check back a fraction of the way to the expected finish, so polling
+        slows down during long syncs and speeds up near the end.
+        """
+
+        if self.eta is None:
+            return minimum
+
+        return max(minimum, min(maximum, self.eta / 4))
+
+    def amount(self, count):
+
+        if self.unit == 'documents':
+            return '{count:.0f} documents'.format(count=count)
+
+        return size(count)
+
+    def describe(self):
+
+        parts = [self.state or 'UNKNOWN']
+
+        if self.copied is not None:
+            if self.total:
+                parts.append('{percent:.0f}% ({copied} of {total})'.format(
+                    percent=100.0 * min(self.copied, self.total) /
+                    self.total,
+                    copied=self.amount(self.copied),
+                    total=self.amount(self.total)))
+            else:
+                parts.append('{copied} copied'.format(
+                    copied=self.amount(self.copied)))
+
+        if self.collections is not None:
+            parts.append('{0}/{1} collections'.format(*self.collections))
+
+        if self.lag is not None and self.state != 'STARTUP2':
+            parts.append('{lag:.0f} seconds behind'.format(lag=self.lag))
+
+        if self.rate is not None and self.state == 'STARTUP2':
+            parts.append('{rate}/s'.format(rate=self.amount(self.rate)))
+
+        if self.eta is not None:
+            parts.append('about {eta} remaining'.format(
+                eta=datetime.timedelta(seconds=int(self.eta))))
+
+        return ', '.join(parts)
+
+
+def size(count):
+
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if count < 1024:
+            return '{count:.1f} {unit}'.format(count=count, unit=unit)
+        count /= 1024.0
+
+    return '{count:.1f} TB'.format(count=count)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from tyr.helpers.cache import describe_cache
+from tyr.servers.exceptions import (NoSecurityGroupsReturned,
+                                    MultipleSecurityGroupsReturned)
+import boto.exception
+import logging
+import threading
+
+# Servers configured at the same time share the cached index, so it is
+# only read and added to while this is held
+index_lock = threading.Lock()
+
+
+class SecurityGroupIndex(object):
+    """
+    An index of security groups keyed by (vpc_id, name). Each VPC is
+    listed with a single DescribeSecurityGroups call and the result is
+    kept in the shared describe cache, so every server in a build resolves
+    its groups from the same listing.
+    """
+
+    def __init__(self, conn, region, cache=describe_cache):
+
+        self.log = logging.getLogger('Tyr.Helpers.SecurityGroupIndex')
+
+        self.conn = conn
+        self.region = region
+        self.cache = cache
+
+    def list_groups(self, vpc_id):
+
+        self.log.info('Listing security groups in {vpc}'.format(
+                      vpc=vpc_id or 'EC2-Classic'))
+
+        if vpc_id is None:
+            groups = self.conn.get_all_security_groups()
+        else:
+            groups = self.conn.get_all_security_groups(
+                filters={'vpc-id': vpc_id})
+
+        index = {}
+
+        for group in groups:
+            if group.vpc_id != vpc_id:
+                continue
+
+            index.setdefault((group.vpc_id, group.name), []).append(group)
+
+        return index
+
+    def groups(self, vpc_id):
+
+        return self.cache.get(self.region, ('security-groups', vpc_id),
+                              lambda: self.list_groups(vpc_id))
+
+    def refresh(self, vpc_id):
+
+        self.cache.invalidate(self.region, ('security-groups', vpc_id))
+
+        return self.groups(vpc_id)
+
+    def lookup(self, name, vpc_id):
+
+        index = self.groups(vpc_id)
+
+        with index_lock:
+            return list(index.get((vpc_id, name), []))
+
+    def exists(self, name, vpc_id):
+
+        return len(self.lookup(name, vpc_id)) > 0
+
+    def missing(self, names, vpc_id):
+
+        return [name for name in names if not self.exists(name, vpc_id)]
+
+    def create(self, names, vpc_id):
+
+        with index_lock:
+            self.create_groups(names, vpc_id)
+
+    def create_groups(self, names, vpc_id):
+
+        index = self.groups(vpc_id)
+
+        for name in names:
+            # Another server may have created it while this one waited
+            if (vpc_id, name) in index:
+                continue
+
+            try:
+                group = self.conn.create_security_group(name, name,
+                                                        vpc_id=vpc_id)
+            except boto.exception.EC2ResponseError as e:
+                if e.error_code != 'InvalidGroup.Duplicate':
+                    raise e
+
+                self.log.info('Security group {group} was created '
+                              'elsewhere'.format(group=name))
+                index = self.refresh(vpc_id)
+                continue
+
+            index.setdefault((vpc_id, name), []).append(group)
+
+    def get(self, name, vpc_id):
+
+        groups = self.lookup(name, vpc_id)
+
+        if len(groups) == 1:
+            return groups[0]
+        elif len(groups) == 0:
+            raise NoSecurityGroupsReturned("No security group returned.")
+        else:
+            raise MultipleSecurityGroupsReturned(
+                "More than 1 security group returned")
+
+    def ids(self, names, vpc_id):
+
+        return [self.get(name, vpc_id).id for name in names]
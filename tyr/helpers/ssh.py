@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from paramiko.client import AutoAddPolicy, SSHClient
+from paramiko.ssh_exception import SSHException
+from tyr.helpers.tracing import tracer
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+
+class SSHPool(object):
+    """
+    Keeps one SSH connection open per (host, user) for the whole process.
+
+    Each command runs on its own channel over the shared transport, so
+    several threads can run commands on the same host at once without a
+    new handshake. Connections idle for longer than `idle_timeout` seconds
+    are closed the next time the pool is used.
+    """
+
+    KEYS = ['~/.ssh/stage', '~/.ssh/prod']
+
+    def __init__(self, idle_timeout=300, retry_interval=10):
+
+        self.log = logging.getLogger('Tyr.Helpers.SSHPool')
+
+        self.idle_timeout = idle_timeout
+        self.retry_interval = retry_interval
+
+        self.connections = {}
+        self.locks = {}
+        self.tunnels = {}
+        self.lock = threading.Lock()
+
+    def connect(self, host, user):
+
+        connection = SSHClient()
+        connection.set_missing_host_key_policy(AutoAddPolicy())
+
+        keys = [os.path.expanduser(key) for key in self.KEYS]
+
+        self.log.info('Attempting to establish SSH connection to {host}'
+                      .format(host=host))
+
+        while True:
+            try:
+                connection.connect(host, username=user, key_filename=keys)
+                break
+            except Exception as err:
+                self.log.warn('Unable to establish SSH connection to {host}: '
+                              '{error}'.format(host=host, error=err))
+                time.sleep(self.retry_interval)
+
+        self.log.info('Successfully established SSH connection to {host}'
+                      .format(host=host))
+
+        # Keep otherwise quiet connections from being dropped by NAT and
+        # firewalls while they wait in the pool
+        connection.get_transport().set_keepalive(30)
+
+        return connection
+
+    def active(self, connection):
+
+        transport = connection.get_transport()
+
+        return transport is not None and transport.is_active()
+
+    def evict_idle(self):
+
+        now = time.time()
+
+        with self.lock:
+            idle = [key for key, entry in self.connections.items()
+                    if entry['users'] == 0 and
+                    now - entry['used'] > self.idle_timeout]
+
+            idle = [(key, self.connections.pop(key)) for key in idle]
+
+        for (host, user), entry in idle:
+            self.log.debug('Closing idle SSH connection to {host}'.format(
+                           host=host))
+            entry['connection'].close()
+
+    def checkout(self, host, user):
+
+        self.evict_idle()
+
+        key = (host, user)
+
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+
+        # Only one thread connects to a host; the others wait and share
+        with lock:
+            with self.lock:
+                entry = self.connections.get(key)
+
+            if entry is not None and not self.active(entry['connection']):
+                self.log.warn('SSH transport to {host} is no longer active'
+                              .format(host=host))
+                self.discard(host, user)
+                entry = None
+
+            if entry is None:
+                entry = {
+                    'connection': self.connect(host, user),
+                    'users': 0,
+                    'used': time.time()
+                }
+
+                with self.lock:
+                    self.connections[key] = entry
+
+            with self.lock:
+                entry['users'] += 1
+
+        return entry
+
+    def checkin(self, entry):
+
+        with self.lock:
+            entry['users'] -= 1
+            entry['used'] = time.time()
+
+    def discard(self, host, user='ec2-user'):
+
+        with self.lock:
+            entry = self.connections.pop((host, user), None)
+
+        if entry is not None:
+            entry['connection'].close()
+
+    def run(self, host, command, user='ec2-user'):
+        """
+        Run `command` on `host`, returning its standard output and error.
+        """
+
+        for attempt in range(2):
+            entry = self.checkout(host, user)
+
+            try:
+                with tracer.span('ssh', host=host, command=command):
+                    stdin, stdout, stderr = entry['connection'].exec_command(
+                        command)
+
+                    try:
+                        out = stdout.read()
+                    except IOError:
+                        out = None
+
+                    try:
+                        err = stderr.read()
+                    except IOError:
+                        err = None
+
+                return out, err
+            except SSHException as e:
+                # The transport failed underneath us; reconnect once
+                if attempt > 0:
+                    raise e
+
+                self.log.warn('SSH command on {host} failed: {error}'.format(
+                              host=host, error=e))
+                self.discard(host, user)
+            finally:
+                self.checkin(entry)
+
+    def put(self, host, local_path, remote_path, user='ec2-user'):
+        """
+        Copy a local file to `host` over SFTP on the pooled connection.
+        """
+
+        entry = self.checkout(host, user)
+
+        try:
+            with tracer.span('sftp', host=host, path=remote_path):
+                sftp = entry['connection'].open_sftp()
+
+                try:
+                    sftp.put(local_path, remote_path)
+                finally:
+                    sftp.close()
+        finally:
+            self.checkin(entry)
+
+    def lines(self, host, command, user='ec2-user', interval=None):
+        """
+        Run a long-lived `command` on `host`, yielding its output line by
+        line as it arrives. With `interval`, None is yielded whenever no
+        output arrives for that many seconds, so the caller can give up.
+        Closing the generator closes the channel.
+        """
+
+        entry = self.checkout(host, user)
+
+        try:
+            stdin, stdout, stderr = entry['connection'].exec_command(command)
+
+            channel = stdout.channel
+            channel.settimeout(interval)
+
+            # Read from the channel directly, as a timeout part way through
+            # a line would lose what readline had buffered of it
+            buffered = ''
+
+            try:
+                while True:
+                    try:
+                        data = channel.recv(4096)
+                    except socket.timeout:
+                        yield None
+                        continue
+
+                    if not data:
+                        break
+
+                    buffered += data
+
+                    while '\n' in buffered:
+                        line, buffered = buffered.split('\n', 1)
+                        yield line + '\n'
+
+                if buffered:
+                    yield buffered
+            finally:
+                channel.close()
+        finally:
+            self.checkin(entry)
+
+    def forward(self, host, remote_port, user='ec2-user'):
+        """
+        Forward a local port to `remote_port` on `host` over the pooled
+        connection, returning the local port.
+        """
+
+        key = (host, user, remote_port)
+
+        with self.lock:
+            tunnel = self.tunnels.get(key)
+
+            if tunnel is None:
+                tunnel = Tunnel(self, host, remote_port, user)
+                self.tunnels[key] = tunnel
+
+        return tunnel.port
+
+    def close(self):
+
+        with self.lock:
+            tunnels = self.tunnels.values()
+            self.tunnels = {}
+
+        for tunnel in tunnels:
+            tunnel.close()
+
+        with self.lock:
+            entries = self.connections.values()
+            self.connections = {}
+
+        for entry in entries:
+            entry['connection'].close()
+
+
+class Tunnel(object):
+    """
+    Listens on a local port and carries each accepted connection to
+    `remote_port` on the remote host over a direct-tcpip channel.
+    """
+
+    def __init__(self, pool, host, remote_port, user='ec2-user'):
+
+        self.log = logging.getLogger('Tyr.Helpers.Tunnel')
+
+        self.pool = pool
+        self.host = host
+        self.remote_port = remote_port
+        self.user = user
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(16)
+
+        self.port = self.server.getsockname()[1]
+        self.closed = False
+
+        # Work done for the tunnel belongs to whoever opened it
+        self.span = tracer.current
+
+        self.log.debug('Forwarding localhost:{local} to {host}:{remote}'
+                       .format(local=self.port, host=host, remote=remote_port))
+
+        thread = threading.Thread(target=self.accept,
+                                  name='Tyr-Tunnel-{port}'.format(
+                                      port=self.port))
+        thread.daemon = True
+        thread.start()
+
+    def accept(self):
+
+        with tracer.adopt(self.span):
+            self.accept_connections()
+
+    def accept_connections(self):
+
+        while not self.closed:
+            try:
+                client, address = self.server.accept()
+            except socket.error:
+                break
+
+            thread = threading.Thread(target=self.handle,
+                                      args=(client, address))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, client, address):
+
+        with tracer.adopt(self.span):
+            self.forward_connection(client, address)
+
+    def forward_connection(self, client, address):
+
+        entry = self.pool.checkout(self.host, self.user)
+
+        try:
+            transport = entry['connection'].get_transport()
+
+            try:
+                channel = transport.open_channel(
+                    'direct-tcpip', ('localhost', self.remote_port), address)
+            except SSHException as e:
+                self.log.warn('Unable to open a tunnel to {host}: {error}'
+                              .format(host=self.host, error=e))
+                return
+
+            try:
+                self.pump(client, channel)
+            finally:
+                channel.close()
+        finally:
+            client.close()
+            self.pool.checkin(entry)
+
+    def pump(self, client, channel):
+
+        while True:
+            readable, _, _ = select.select([client, channel], [], [])
+
+            if client in readable:
+                data = client.recv(32768)
+
+                if not data:
+                    break
+
+                channel.sendall(data)
+
+            if channel in readable:
+                data = channel.recv(32768)
+
+                if not data:
+                    break
+
+                client.sendall(data)
+
+    def close(self):
+
+        self.closed = True
+        self.server.close()
+
+
+ssh_pool = SSHPool()
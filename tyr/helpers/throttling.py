@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from boto.exception import BotoServerError
+import logging
+import random
+import re
+import threading
+import time
+
+# Error codes AWS answers with when a caller goes over its request rate
+THROTTLING = frozenset([
+    'Throttling', 'ThrottlingException', 'ThrottledException',
+    'RequestThrottledException', 'RequestThrottled', 'RequestLimitExceeded',
+    'TooManyRequestsException', 'PriorRequestNotComplete',
+    'EC2ThrottledException', 'BandwidthLimitExceeded', 'SlowDown'
+])
+
+# Error codes of failures which are expected to go away on their own
+TRANSIENT = frozenset([
+    'InternalError', 'InternalFailure', 'ServiceUnavailable',
+    'RequestTimeout', 'RequestTimeoutException', 'Unavailable'
+])
+
+TRANSIENT_STATUSES = frozenset([500, 502, 503, 504])
+
+# Sustained requests per second and burst size for each service. These
+# stay below the account wide limits AWS documents, which every process
+# building in the account shares.
+RATES = {
+    'ec2': (20, 100),
+    'autoscaling': (10, 40),
+    'iam': (10, 20),
+    'route53': (5, 5)
+}
+
+DEFAULT_RATE = (10, 20)
+
+
+def error_code(body):
+
+    if not body:
+        return None
+
+    match = re.search(r'<Code>([^<]+)</Code>', body)
+
+    if match is None:
+        match = re.search(r'"__type"\s*:\s*"(?:[^"#]*#)?([^"]+)"', body)
+
+    return match.group(1) if match else None
+
+
+class Retry(Exception):
+    """
+    Raised out of boto's request loop to have Throttle send it again.
+    """
+
+    def __init__(self, reason):
+
+        super(Retry, self).__init__(reason)
+        self.reason = reason
+
+
+class TokenBucket(object):
+    """
+    Lets through `rate` requests a second on average, and bursts of up to
+    `burst` at once, to every thread sharing it.
+    """
+
+    def __init__(self, rate, burst):
+
+        self.rate = float(rate)
+        self.burst = burst
+
+        self.lock = threading.Lock()
+        self.tokens = float(burst)
+        self.updated = time.time()
+
+    def refill(self):
+
+        now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Take a token, blocking until one is available. Returns the seconds
+        spent waiting.
+        """
+
+        waited = 0
+
+        while True:
+            with self.lock:
+                self.refill()
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+    def drain(self):
+        """
+        Spend every token, so that all callers wait for the bucket to
+        refill once AWS reports throttling.
+        """
+
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, 0)
+
+
+class Throttle(object):
+    """
+    Holds the AWS API calls of instrumented boto connections and boto3
+    clients to a token bucket for each service and region, shared by every
+    thread in the process, and retries calls which are throttled or fail
+    transiently after a jittered, exponentially growing delay.
+    """
+
+    def __init__(self, rates=None, retries=5, base=0.5, cap=20):
+
+        self.log = logging.getLogger('Tyr.Helpers.Throttle')
+
+        self.rates = dict(RATES)
+        self.rates.update(rates or {})
+
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def reset(self):
+
+        with self.lock:
+            self.buckets = {}
+
+    def set_rate(self, service, rate, burst):
+
+        with self.lock:
+            self.rates[service] = (rate, burst)
+            self.buckets = dict((key, bucket) for key, bucket
+                                in self.buckets.items() if key[0] != service)
+
+    def bucket(self, service, region):
+
+        key = (service, region)
+
+        with self.lock:
+            try:
+                return self.buckets[key]
+            except KeyError:
+                rate, burst = self.rates.get(service, DEFAULT_RATE)
+                bucket = self.buckets[key] = TokenBucket(rate, burst)
+                return bucket
+
+    def delay(self, attempt):
+
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def retryable(self, status, code):
+
+        return code in THROTTLING or code in TRANSIENT or \
+            status in TRANSIENT_STATUSES
+
+    def instrument(self, connection):
+        """
+        Throttle the calls made through a boto connection or a boto3
+        client, returning it.
+        """
+
+        if getattr(connection, 'tyr_throttled', False):
+            return connection
+
+        if hasattr(connection, 'meta'):
+            self.instrument_client(connection)
+        else:
+            self.instrument_connection(connection)
+
+        connection.tyr_throttled = True
+
+        return connection
+
+    def instrument_connection(self, connection):
+
+        throttle = self
+
+        # ec2.us-east-1.amazonaws.com, or iam.amazonaws.com for global
+        # services
+        parts = connection.host.split('.')
+        service = parts[0]
+        region = parts[1] if len(parts) > 3 else 'global'
+
+        bucket = self.bucket(service, region)
+
+        inner = vars(connection).get('_mexe')
+
+        def send(*args, **kwargs):
+
+            if inner is not None:
+                return inner(*args, **kwargs)
+
+            return type(connection)._mexe(connection, *args, **kwargs)
+
+        def mexe(request, sender=None, override_num_retries=None,
+                 retry_handler=None):
+
+            retries = throttle.retries if override_num_retries is None \
+                else override_num_retries
+
+            attempt = [0]
+            sent = {}
+
+            def send_request(http_connection, method, path, body, headers):
+
+                # Kept so it can be returned to boto's pool on a retry
+                sent['connection'] = http_connection
+
+                if callable(sender):
+                    return sender(http_connection, method, path, body,
+                                  headers)
+
+                http_connection.request(method, path, body, headers)
+                return http_connection.getresponse()
+
+            def release(response):
+
+                http_connection = sent.pop('connection', None)
+
+                if http_connection is None:
+                    return
+
+                if response.getheader('connection') == 'close':
+                    http_connection.close()
+                else:
+                    connection.put_http_connection(request.host, request.port,
+                                                   connection.is_secure,
+                                                   http_connection)
+
+            def check(response, i, next_sleep):
+
+                if callable(retry_handler):
+                    status = retry_handler(response, i, next_sleep)
+
+                    if status:
+                        return status
+
+                if response.status < 400:
+                    return None
+
+                # boto caches the body, so it can still be read by the
+                # caller if the response is returned
+                body = response.read()
+                code = error_code(body)
+
+                if not throttle.retryable(response.status, code):
+                    return None
+
+                release(response)
+
+                if attempt[0] < retries:
+                    raise Retry(code or response.status)
+
+                if response.status >= 500:
+                    # What boto raises once its own retries run out
+                    raise BotoServerError(response.status, response.reason,
+                                          body)
+
+                return None
+
+            while True:
+                waited = bucket.acquire()
+
+                if waited > 1:
+                    throttle.log.debug('Waited {waited:.2f} seconds to call '
+                                       '{service} in {region}'.format(
+                                           waited=waited, service=service,
+                                           region=region))
+
+                try:
+                    # boto still retries connection errors itself; throttled
+                    # and failed answers are retried here, so each attempt
+                    # waits its turn for the bucket
+                    return send(request, send_request, override_num_retries,
+                                retry_handler=check)
+                except Retry as e:
+                    reason = e.reason
+
+                    if reason in THROTTLING:
+                        bucket.drain()
+
+                attempt[0] += 1
+                delay = throttle.delay(attempt[0])
+
+                throttle.log.warn('{service} in {region} answered {reason}; '
+                                  'retrying in {delay:.2f} seconds '
+                                  '({attempt}/{retries})'.format(
+                                      service=service, region=region,
+                                      reason=reason, delay=delay,
+                                      attempt=attempt[0], retries=retries))
+
+                time.sleep(delay)
+
+        connection._mexe = mexe
+
+    def instrument_client(self, client):
+        """
+        botocore already retries throttled and failed calls with jittered
+        backoff, so a boto3 client only waits on the bucket before each
+        attempt, and drains it when throttled.
+        """
+
+        service = client.meta.service_model.endpoint_prefix
+        bucket = self.bucket(service, client.meta.region_name or 'global')
+
+        def created(**kwargs):
+
+            bucket.acquire()
+
+        def needs_retry(response=None, **kwargs):
+
+            if response is None:
+                return None
+
+            code = response[1].get('Error', {}).get('Code')
+
+            if code in THROTTLING:
+                bucket.drain()
+
+            return None
+
+        client.meta.events.register(
+            'request-created.{service}'.format(service=service), created)
+        client.meta.events.register(
+            'needs-retry.{service}'.format(service=service), needs_retry)
+
+
+throttle = Throttle()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+import contextlib
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+
+class Span(object):
+
+    def __init__(self, span_id, parent_id, name, attributes):
+
+        self.id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+
+        self.thread = threading.current_thread().name
+        self.thread_id = threading.current_thread().ident
+
+        self.start = time.time()
+        self.end = None
+        self.error = None
+
+    def set(self, **attributes):
+
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self):
+
+        return (self.end or time.time()) - self.start
+
+    def to_dict(self):
+
+        return {
+            'id': self.id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'attributes': self.attributes,
+            'thread': self.thread,
+            'start': self.start,
+            'end': self.end,
+            'duration': self.duration,
+            'error': self.error
+        }
+
+
+class Tracer(object):
+    """
+    Records nested, timed spans of work. Each thread has its own stack of
+    open spans; a worker thread can adopt a span from the thread which
+    started it, so the worker's spans nest under it.
+
+    Spans are always kept on the stacks, so work can be attributed to the
+    span it runs in, but finished spans are only kept for export once
+    tracing is enabled.
+    """
+
+    def __init__(self, enabled=False):
+
+        self.log = logging.getLogger('Tyr.Helpers.Tracer')
+
+        self.enabled = enabled
+        self.spans = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @property
+    def stack(self):
+
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    @property
+    def current(self):
+
+        return self.stack[-1] if self.stack else None
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+
+        stack = self.stack
+        parent = stack[-1].id if stack else None
+
+        with self.lock:
+            span = Span(next(self.ids), parent, name, attributes)
+
+            if self.enabled:
+                self.spans.append(span)
+
+        stack.append(span)
+
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end = time.time()
+            stack.pop()
+
+            self.log.debug('Executed {name} in {elapsed} seconds'.format(
+                           name=name, elapsed=span.duration))
+
+    @contextlib.contextmanager
+    def adopt(self, span):
+
+        if span is None:
+            yield
+            return
+
+        self.stack.append(span)
+
+        try:
+            yield
+        finally:
+            self.stack.pop()
+
+    def traced(self, name=None, **attributes):
+        """
+        Decorate a function so each call is recorded as a span.
+        """
+
+        def decorator(method):
+
+            span_name = name or method.__name__
+
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+
+                with self.span(span_name, **attributes):
+                    return method(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def enable(self):
+
+        self.enabled = True
+
+    def reset(self):
+
+        with self.lock:
+            self.spans = []
+
+    def to_json(self):
+
+        with self.lock:
+            return [span.to_dict() for span in self.spans]
+
+    def to_chrome(self):
+        """
+        Spans as Chrome trace events, for chrome://tracing or Perfetto.
+        """
+
+        pid = os.getpid()
+        events = []
+
+        with self.lock:
+            spans = list(self.spans)
+
+        for span in spans:
+            args = dict(span.attributes)
+
+            if span.error is not None:
+                args['error'] = span.error
+
+            events.append({
+                'name': span.name,
+                'cat': 'tyr',
+                'ph': 'X',
+                'ts': int(span.start * 1e6),
+                'dur': int(span.duration * 1e6),
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': args
+            })
+
+        for thread_id, thread in set((span.thread_id, span.thread)
+                                     for span in spans):
+            events.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': pid,
+                'tid': thread_id,
+                'args': {'name': thread}
+            })
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path, format='chrome'):
+
+        document = self.to_chrome() if format == 'chrome' else self.to_json()
+
+        with open(os.path.expanduser(path), 'w') as f:
+            json.dump(document, f, default=str, indent=1)
+
+        self.log.info('Wrote {count} spans to {path}'.format(
+                      count=len(self.spans), path=path))
+
+
+tracer = Tracer()
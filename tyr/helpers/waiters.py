@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+from tyr.servers.exceptions import InstanceWaitTimeout, InstanceFailedToStart
+import boto.exception
+import logging
+import time
+
+
+log = logging.getLogger('Tyr.Helpers.Waiters')
+
+FAILED_STATES = ['shutting-down', 'terminated', 'stopping', 'stopped']
+
+
+def describe_instance_status(conn, instance_ids):
+
+    statuses = {}
+
+    # DescribeInstanceStatus accepts at most 100 instance IDs per call
+    for start in range(0, len(instance_ids), 100):
+        chunk = instance_ids[start:start + 100]
+
+        try:
+            response = conn.get_all_instance_status(
+                instance_ids=chunk, include_all_instances=True)
+        except boto.exception.EC2ResponseError as e:
+            # Instances may not be visible to the API immediately after
+            # being launched
+            if e.error_code == 'InvalidInstanceID.NotFound':
+                continue
+            raise e
+
+        for status in response:
+            statuses[status.id] = status
+
+    return statuses
+
+
+def ready(status, status_checks=False):
+
+    if status.state_name != 'running':
+        return False
+
+    if not status_checks:
+        return True
+
+    return (status.system_status.status == 'ok' and
+            status.instance_status.status == 'ok')
+
+
+def wait_for_instances(conn, instance_ids, status_checks=False,
+                       interval=2, max_interval=30, backoff=1.5,
+                       timeout=1800):
+    """
+    Wait until every instance is running, and optionally until both EC2
+    status checks pass, polling all of them with one DescribeInstanceStatus
+    call per tick.
+    """
+
+    pending = list(instance_ids)
+    deadline = time.time() + timeout
+
+    log.info('Waiting for {count} instances to be {state}'.format(
+             count=len(pending),
+             state='healthy' if status_checks else 'running'))
+
+    while True:
+        statuses = describe_instance_status(conn, pending)
+
+        for instance_id in list(pending):
+            status = statuses.get(instance_id)
+
+            if status is None:
+                continue
+
+            if status.state_name in FAILED_STATES:
+                raise InstanceFailedToStart(
+                    '{instance} entered the {state} state'.format(
+                        instance=instance_id, state=status.state_name))
+
+            if ready(status, status_checks):
+                log.info('{instance} is ready'.format(instance=instance_id))
+                pending.remove(instance_id)
+
+        if not pending:
+            break
+
+        if time.time() + interval > deadline:
+            raise InstanceWaitTimeout(
+                'Timed out waiting for {instances}'.format(
+                    instances=', '.join(pending)))
+
+        log.debug('Waiting on {instances}; checking again in {interval:.0f} '
+                  'seconds'.format(instances=', '.join(pending),
+                                   interval=interval))
+
+        time.sleep(interval)
+        interval = min(interval * backoff, max_interval)
+
+    log.info('All instances are ready')
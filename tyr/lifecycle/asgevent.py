@@ -1,4 +1,4 @@
-import boto3
+from tyr.helpers import connection_registry
 import logging
 
 class ASGEvent(object):
@@ -16,7 +16,7 @@ class ASGEvent(object):
 
     def get_role_arn(self, role_name):
 
-        iam = boto3.client('iam')
+        iam = connection_registry.client('iam')
         roles = iam.get_role(RoleName=role_name)
 
         self.log.info('Found role ARN for lifecycle[{arn}]'.format(arn=roles['Role']['Arn']))
@@ -24,7 +24,7 @@ class ASGEvent(object):
         return roles['Role']['Arn']
 
     def create_event(self):
-        client = boto3.client('autoscaling')
+        client = connection_registry.client('autoscaling')
 
         self.log.info('Creating lifecycle hook name[{name}] asg[{asg}] transaction[{transition}]'.format(name=self.hook_name,
                         asg=self.asg_name,
@@ -1,4 +1,5 @@
 from tyr.servers.server import Server
+from tyr.helpers import api_account
 import chef
 import requests
 import time
@@ -156,6 +157,7 @@ class CacheServer(Server):
                 self.log.error('Recieved response {response}'.format(
                                                         response=r.json()))
 
+    @api_account.accounted
     def autorun(self):
 
         super(CacheServer, self).autorun()
@@ -36,3 +36,41 @@ class NoSecurityGroupsReturned(Exception):
 
 class MultipleSecurityGroupsReturned(Exception):
     pass
+
+
+class NoIndexAvailable(Exception):
+    pass
+
+
+class InstanceWaitTimeout(Exception):
+    pass
+
+
+class InstanceFailedToStart(Exception):
+    pass
+
+
+class DNSChangeTimeout(Exception):
+    pass
+
+
+class ChefRunFailed(Exception):
+    pass
+
+
+class ClusterProvisioningFailed(Exception):
+
+    def __init__(self, errors):
+        self.errors = errors
+
+        super(ClusterProvisioningFailed, self).__init__(
+            '; '.join('{node}: {error}'.format(node=node, error=error)
+                      for node, error in errors))
+
+
+class ReplicaSetWaitTimeout(Exception):
+    pass
+
+
+class ApiBudgetExceeded(Exception):
+    pass
@@ -92,3 +92,6 @@ class IISNode(Server):
             self.log.critical('No user info found, exiting!')
             exit(1)
         return user_data
+
+    # The user data does not name the node, so it can be shared as is
+    batch_user_data = user_data
@@ -1,5 +1,5 @@
 from tyr.servers.server import Server
-import json
+from tyr.helpers import mongo_admin
 
 
 class MongoNode(Server):
@@ -87,12 +87,7 @@ class MongoNode(Server):
 
         self.resolve_security_groups()
 
-    def run_mongo(self, command):
+    @property
+    def admin(self):
 
-        template = 'mongo --port 27018 --eval "JSON.stringify({command})"'
-
-        command = template.format(command=command)
-
-        r = self.run(command)
-
-        return json.loads(r['out'].split('\n')[2])
+        return mongo_admin(self.instance.private_dns_name)
@@ -68,3 +68,6 @@ class NginxServer(Server):
         except IOError:
             self.log.critical('chef-validator key not found!')
             exit(1)
+
+    # The user data does not name the node, so it can be shared as is
+    batch_user_data = user_data
@@ -1,4 +1,5 @@
 from tyr.servers.server import Server
+from tyr.helpers import api_account
 import re
 
 
@@ -160,6 +161,7 @@ class PostfixMaster(Server):
 
         return alloc_id
 
+    @api_account.accounted
     def autorun(self):
         """
         Assign the EIP after the instance is up and configured.
@@ -1,8 +1,10 @@
 from exceptions import (InvalidKeyPair, InvalidAvailabilityZone,
                         NoSubnetReturned, RegionDoesNotExist,
-                        InvalidCluster, InvalidAMI, NoSecurityGroupsReturned,
-                        MultipleSecurityGroupsReturned)
+                        InvalidCluster, InvalidAMI)
 import boto.ec2
+import collections
+import contextlib
+import copy
 import boto.route53
 import boto.ec2.networkinterface
 import logging
@@ -12,10 +14,12 @@ import time
 from boto.ec2.networkinterface import NetworkInterfaceSpecification
 import json
 from boto.ec2.networkinterface import NetworkInterfaceCollection
-import urllib
-from boto.vpc import VPCConnection
-from paramiko.client import AutoAddPolicy, SSHClient
+from paramiko.ssh_exception import SSHException
 from tyr.policies import policies
+from tyr.helpers import (describe_cache, SecurityGroupIndex, index_allocator,
+                         wait_for_instances, ChangeBatch, wait_for_changes,
+                         iam_reconciler, ssh_pool, tracer, api_account,
+                         connection_registry)
 import cloudspecs.aws.ec2
 import re
 import boto3
@@ -74,6 +78,17 @@ class Server(object):
         self.create_alerts = False
         self.chef_server_url = chef_server_url
         self.use_latest_ami = use_latest_ami
+        self.configured = False
+        self.instance = None
+
+        # Configuration writes to this, and the batch user data carries it,
+        # so each server needs its own copy
+        self.CHEF_ATTRIBUTES = copy.deepcopy(self.CHEF_ATTRIBUTES)
+
+        # Policies are added to these as servers are configured alongside
+        # others of their class
+        self.IAM_ROLE_POLICIES = list(self.IAM_ROLE_POLICIES)
+        self.IAM_MANAGED_POLICIES = list(self.IAM_MANAGED_POLICIES)
 
     def get_latest_ami(self, ami=None, platform="linux"):
         if ami is not None or self.use_latest_ami is False:
@@ -87,7 +102,11 @@ class Server(object):
             ami_filter = {'architecture': 'x86_64',
                           'name': 'Windows_Server-2012-R2_RTM-English-64Bit-Base-*'}
 
-        images = self.ec2.get_all_images(owners=['amazon'], filters=ami_filter)
+        images = describe_cache.get(self.region,
+                                    ('latest-images', ami_filter['name']),
+                                    lambda: self.ec2.get_all_images(
+                                        owners=['amazon'],
+                                        filters=ami_filter))
         image = sorted(images, key=attrgetter('creationDate'))[-1]
 
         return image.id
@@ -162,7 +181,11 @@ class Server(object):
             self.log.warn('No region provided')
             self.region = 'us-east-1'
 
-        valid = lambda r: r in [region.name for region in boto.ec2.regions()]
+        regions = describe_cache.get(None, 'regions',
+                                     lambda: [region.name for region in
+                                              boto.ec2.regions()])
+
+        valid = lambda r: r in regions
 
         if not valid(self.region):
 
@@ -187,7 +210,9 @@ class Server(object):
                 self.log.info('Found AMI [' + str(self.ami) + ']')
 
         try:
-            self.ec2.get_all_images(image_ids=[self.ami])
+            describe_cache.get(self.region, ('images', self.ami),
+                               lambda: self.ec2.get_all_images(
+                                   image_ids=[self.ami]))
         except Exception as e:
             self.log.error(str(e))
             if 'Invalid id' in str(e):
@@ -210,8 +235,11 @@ class Server(object):
             if self.environment == 'prod':
                 self.keypair = 'bkaiserkey'
 
-        valid = lambda k: k in [pair.name for pair in
-                                self.ec2.get_all_key_pairs()]
+        key_pairs = describe_cache.get(self.region, 'key-pairs',
+                                       lambda: [pair.name for pair in
+                                                self.ec2.get_all_key_pairs()])
+
+        valid = lambda k: k in key_pairs
 
         if not valid(self.keypair):
             error = '"{keypair}" is not a valid EC2 keypair'.format(
@@ -242,7 +270,11 @@ class Server(object):
         if len(self.availability_zone) == 1:
             self.availability_zone = self.region + self.availability_zone
 
-        valid = lambda z: z in [zone.name for zone in self.ec2.get_all_zones()]
+        zones = describe_cache.get(self.region, 'zones',
+                                   lambda: [zone.name for zone in
+                                            self.ec2.get_all_zones()])
+
+        valid = lambda z: z in zones
 
         if not valid(self.availability_zone):
             error = '"{zone}" is not a valid EC2 availability zone'.format(
@@ -334,6 +366,7 @@ class Server(object):
 
         self.set_chef_attributes()
 
+        self.configured = True
 
     @property
     def location(self):
@@ -360,40 +393,38 @@ class Server(object):
         except Exception:
             pass
 
-        template = self.NAME_SEARCH_PREFIX + '*'
-
-        name_filter = template.format(**supplemental)
+        prefix = self.NAME_SEARCH_PREFIX.format(**supplemental)
 
-        filters = {
-            'tag:Name': name_filter,
-            'instance-state-name': 'running'
-        }
+        self.index = index_allocator.reserve(self.ec2, {prefix: 1})[prefix][0]
 
-        reservations = self.ec2.get_all_instances(filters=filters)
-
-        instances = []
-
-        for reservation in reservations:
-            instances.extend(reservation.instances)
+        return self.index
 
-        names = [instance.tags['Name'] for instance in instances]
+    @staticmethod
+    def reserve_indexes(servers):
+        """
+        Name a batch of configured servers up front, reserving the indexes
+        for every name prefix with a single instance query per region.
+        """
 
-        indexes = [name.split('-')[-1] for name in names]
-        indexes = [int(index) for index in indexes if index.isdigit()]
+        by_region = {}
 
-        index = -1
+        for server in servers:
+            if not server.NAME_AUTO_INDEX or hasattr(server, 'index'):
+                continue
 
-        for i in range(99):
-            if (i + 1) not in indexes:
-                index = i + 1
-                break
+            pending = by_region.setdefault(server.region, {})
+            pending.setdefault(server.name_prefix, []).append(server)
 
-        self.index = str(index)
+        for pending in by_region.values():
+            counts = dict((prefix, len(members))
+                          for prefix, members in pending.items())
 
-        if len(self.index) == 1:
-            self.index = '0'+self.index
+            ec2 = pending.values()[0][0].ec2
+            allocated = index_allocator.reserve(ec2, counts)
 
-        return self.index
+            for prefix, members in pending.items():
+                for server, index in zip(members, allocated[prefix]):
+                    server.index = index
 
     @property
     def envcl(self):
@@ -407,6 +438,21 @@ class Server(object):
 
         return envcl
 
+    @property
+    def name_parameters(self):
+
+        supplemental = self.__dict__.copy()
+
+        supplemental['envcl'] = self.envcl
+        supplemental['location'] = self.location
+
+        return supplemental
+
+    @property
+    def name_prefix(self):
+
+        return self.NAME_SEARCH_PREFIX.format(**self.name_parameters)
+
     @property
     def name(self):
 
@@ -417,10 +463,7 @@ class Server(object):
 
         template = self.NAME_TEMPLATE
 
-        supplemental = self.__dict__.copy()
-
-        supplemental['envcl'] = self.envcl
-        supplemental['location'] = self.location
+        supplemental = self.name_parameters
 
         if self.NAME_AUTO_INDEX:
 
@@ -434,7 +477,7 @@ class Server(object):
         return self.unique_name
 
     @property
-    def hostname(self):
+    def hostname_template(self):
 
         template = '{name}.thorhudl.com'
 
@@ -443,7 +486,12 @@ class Server(object):
         elif self.environment == 'prod':
             template = '{name}.app.hudl.com'
 
-        hostname = template.format(name=self.name)
+        return template
+
+    @property
+    def hostname(self):
+
+        hostname = self.hostname_template.format(name=self.name)
 
         self.log.info('Using hostname {hostname}'.format(hostname=hostname))
 
@@ -451,6 +499,38 @@ class Server(object):
 
     @property
     def user_data(self):
+        return self.render_user_data(self.name, self.hostname)
+
+    @property
+    def batch_user_data(self):
+        """
+        User data which can be shared by several instances launched in one
+        reservation. The node name is read from the instance's Name tag at
+        boot rather than being written into the script.
+        """
+
+        lookup = '\n'.join([
+            'INSTANCE_ID=$(curl -s http://169.254.169.254/latest/meta-data/'
+            'instance-id)',
+            'TYR_NAME=None',
+            'while [ -z "$TYR_NAME" ] || [ "$TYR_NAME" = "None" ]; do',
+            'sleep 5',
+            'TYR_NAME=$(/usr/bin/aws ec2 describe-tags --region {region} '
+            '--filters "Name=resource-id,Values=$INSTANCE_ID" '
+            '"Name=key,Values=Name" --query \'Tags[0].Value\' '
+            '--output text)'.format(region=self.region),
+            'done',
+            'TYR_HOSTNAME={hostname}'.format(
+                hostname=self.hostname_template.format(name='$TYR_NAME')),
+            ''
+        ])
+
+        # The node name is written inside a single-quoted echo, so the
+        # quotes are closed around the variable for it to be expanded
+        return self.render_user_data('\'"$TYR_NAME"\'', '$TYR_HOSTNAME',
+                                     name_lookup=lookup)
+
+    def render_user_data(self, name, hostname, name_lookup=''):
         # Cannot use CamelCase for roles on the Chef12 Server convert to lower.
         if re.match('.+chef12.+', self.chef_server_url):
             self.CHEF_RUNLIST = map(lambda l: l.lower(), self.CHEF_RUNLIST)
@@ -480,7 +560,7 @@ Content-Transfer-Encoding: 7bit
 Content-Disposition: attachment; filename="user-script.txt"
 
 #!/bin/bash
-sed -i '/requiretty/d' /etc/sudoers
+{name_lookup}sed -i '/requiretty/d' /etc/sudoers
 hostname {hostname}
 sed -i 's/^releasever=latest/# releasever=latest/' /etc/yum.conf
 yum clean all
@@ -519,12 +599,13 @@ chef-client -r '{run_list}' -L {logfile} -j /etc/chef/attributes.json
         if re.match('.*chef\.app\.hudl\.com.*', self.chef_server_url):
             validation_client = 'chef-validator'
 
-        return template.format(hostname=self.hostname,
+        return template.format(hostname=hostname,
+                               name_lookup=name_lookup,
                                chef_env=self.environment,
                                validation_client_name=validation_client,
                                chef_server_url=self.chef_server_url,
                                validation_key=validation_key,
-                               name=self.name,
+                               name=name,
                                attributes=json.dumps(self.CHEF_ATTRIBUTES)
                                .replace('"', '\\"'),
                                run_list=self.CHEF_RUNLIST[0],
@@ -580,10 +661,16 @@ named {name}""".format(path=d['path'], name=d['name']))
 
         return bdm
 
+    def get_subnets(self, subnet_id):
+
+        vpc = connection_registry.get('vpc', self.region)
+
+        return describe_cache.get(self.region, ('subnets', subnet_id),
+                                  lambda: vpc.get_all_subnets(
+                                      filters={'subnet-id': subnet_id}))
+
     def get_subnet_vpc_id(self, subnet_id):
-        vpc_conn = VPCConnection()
-        subnets = vpc_conn.get_all_subnets(
-            filters={'subnet_id': subnet_id})
+        subnets = self.get_subnets(subnet_id)
         if len(subnets) == 1:
             vpc_id = subnets[0].vpc_id
             return vpc_id
@@ -593,172 +680,61 @@ named {name}""".format(path=d['path'], name=d['name']))
         else:
             raise Exception("More than 1 subnet returned")
 
+    @property
+    def security_group_index(self):
+        return SecurityGroupIndex(self.ec2, self.region)
+
+    @tracer.traced('security-groups')
     def resolve_security_groups(self):
         self.log.info("Resolving security groups")
 
         # If the server is being spun up in a vpc, search only that vpc
-        exists = lambda s: s in [group.name for group in
-                                 self.ec2.get_all_security_groups()
-                                 if self.vpc_id == group.vpc_id]
+        missing = self.security_group_index.missing(self.security_groups,
+                                                    self.vpc_id)
 
-        for index, group in enumerate(self.security_groups):
-
-            if not exists(group):
+        for group in self.security_groups:
+            if group in missing:
                 self.log.info('Security Group {group} does not exist'
                               .format(group=group))
-                if self.subnet_id is None:
-                    self.ec2.create_security_group(group, group)
-                else:
-                    vpc_conn = VPCConnection()
-                    vpc_conn.create_security_group(
-                        group, group, vpc_id=self.vpc_id)
-                self.log.info('Created security group {group}'
-                              .format(group=group))
             else:
                 self.log.info('Security Group {group} already exists'
                               .format(group=group))
 
-    def resolve_iam_role(self):
-
-        role_exists = False
-        profile_exists = False
+        if missing:
+            self.security_group_index.create(missing, self.vpc_id)
+            self.log.info('Created security groups {groups}'
+                          .format(groups=', '.join(missing)))
 
-        try:
-            self.iam.get_instance_profile(self.role)
-            profile_exists = True
-        except Exception as e:
-            if '404 Not Found' in str(e):
-                pass
-            else:
-                self.log.error(str(e))
-                raise e
-
-        if not profile_exists:
-            try:
-                self.iam.create_instance_profile(self.role)
-                self.log.info('Created IAM Profile {profile}'.format(
-                              profile=self.role))
-
-            except Exception as e:
-                self.log.error(str(e))
-                raise e
-
-        try:
-            self.iam.get_role(self.role)
-            role_exists = True
-        except Exception as e:
-            if '404 Not Found' in str(e):
-                pass
-            else:
-                self.log.error(str(e))
-                raise e
-
-        if not role_exists:
-
-            try:
-                self.iam.create_role(self.role)
-                self.log.info('Created IAM Role {role}'.format(role=self.role))
-                self.iam.add_role_to_instance_profile(self.role, self.role)
-                self.log.info('Attached Role {role}'
-                              ' to Profile {profile}'.format(
-                                  role=self.role, profile=self.role))
-
-            except Exception as e:
-                self.log.error(str(e))
-                raise e
-
-        role_policies = self.iam.list_role_policies(self.role)
-        response = role_policies['list_role_policies_response']
-        result = response['list_role_policies_result']
-        existing_policies = result['policy_names']
-
-        self.log.info('Existing policies: '
-                      '{policies}'.format(policies=existing_policies))
+    @tracer.traced('iam')
+    def resolve_iam_role(self):
 
         self.IAM_ROLE_POLICIES.extend(self.GLOBAL_IAM_ROLE_POLICIES)
         self.IAM_ROLE_POLICIES = list(set(self.IAM_ROLE_POLICIES))
-        for policy_template in self.IAM_ROLE_POLICIES:
-            policy = policy_template.format(environment=self.environment)
-
-        # If managed policies exist, then add them:
-        if (len(self.IAM_MANAGED_POLICIES) > 0):
-            self.log.info("Adding managed policies [" + str(self.IAM_MANAGED_POLICIES).format(environment=self.environment) + "] to role [" + self.role + "]")
 
-            for m_policy in self.IAM_MANAGED_POLICIES:
-                m_policy_id = m_policy.format(environment=self.environment)
-                arn = self.iam.get_user().user.arn
-                account_id = arn[arn.find('::')+2:arn.rfind(':')]
-                m_policy_arn = self.iam.get_policy("arn:aws:iam::{account_id}:policy/{policy}".format(account_id=account_id, policy=m_policy_id))
-                self.iam.attach_role_policy("arn:aws:iam::{account_id}:policy/{policy}".format(account_id=account_id, policy=m_policy_id), self.role)
+        inline_policies = {}
 
         for policy_template in self.IAM_ROLE_POLICIES:
             policy = policy_template.format(environment=self.environment)
 
             self.log.info('Processing policy "{policy}"'.format(policy=policy))
 
-            if policy not in existing_policies:
-
-                rolePolicy = policies[policy]
-
-                if rolePolicy is None:
-                    self.log.info("No policy defined for {policy}".format(
-                                  policy=policy))
-                    continue  # Go to the next policy
-
-                self.log.info('Policy "{policy}" does not exist'.format(
-                              policy=policy))
-
-                try:
-                    self.iam.put_role_policy(self.role, policy,
-                                             rolePolicy)
-
-                    self.log.info('Added policy "{policy}"'.format(
-                                  policy=policy))
-                except Exception as e:
-                    self.log.error(str(e))
-                    raise e
-
-            else:
-
-                self.log.info('Policy "{policy}" already exists'.format(
+            if policies[policy] is None:
+                self.log.info("No policy defined for {policy}".format(
                               policy=policy))
+                continue  # Go to the next policy
 
-                tyr_copy = json.loads(policies[policy])
-
-                aws_copy = self.iam.get_role_policy(self.role, policy)
-                aws_copy = aws_copy['get_role_policy_response']
-                aws_copy = aws_copy['get_role_policy_result']
-                aws_copy = aws_copy['policy_document']
-                aws_copy = urllib.unquote(aws_copy)
-                aws_copy = json.loads(aws_copy)
-
-                if tyr_copy == aws_copy:
-                    self.log.info('Policy "{policy}" is accurate'.format(
-                                  policy=policy))
-
-                else:
-
-                    self.log.warn('Policy "{policy}" has been modified'.format(
-                                  policy=policy))
-
-                    try:
-                        self.iam.delete_role_policy(self.role, policy)
+            inline_policies[policy] = policies[policy]
 
-                        self.log.info('Removed policy "{policy}"'.format(
-                                      policy=policy))
-                    except Exception as e:
-                        self.log.error(str(e))
-                        raise e
+        managed_policies = [m_policy.format(environment=self.environment)
+                            for m_policy in self.IAM_MANAGED_POLICIES]
 
-                    try:
-                        self.iam.put_role_policy(self.role, policy,
-                                                 policies[policy])
+        if managed_policies:
+            self.log.info('Adding managed policies {policies} to role '
+                          '{role}'.format(policies=managed_policies,
+                                          role=self.role))
 
-                        self.log.info('Added policy "{policy}"'.format(
-                                      policy=policy))
-                    except Exception as e:
-                        self.log.error(str(e))
-                        raise e
+        iam_reconciler.reconcile(self.iam, self.role, inline_policies,
+                                 managed_policies)
 
     def establish_ec2_connection(self):
 
@@ -767,7 +743,7 @@ named {name}""".format(path=d['path'], name=d['name']))
         self.log.info("Attempting to connect to EC2")
 
         try:
-            self.ec2 = boto.ec2.connect_to_region(self.region)
+            self.ec2 = connection_registry.get('ec2', self.region)
             self.log.info('Established connection to EC2')
         except Exception as e:
             self.log.error(str(e))
@@ -776,9 +752,7 @@ named {name}""".format(path=d['path'], name=d['name']))
     def get_subnet_availability_zone(self, subnet_id):
         self.log.info(
             "getting zone for subnet {subnet_id}".format(subnet_id=subnet_id))
-        vpc_conn = VPCConnection()
-        filters = {'subnet-id': subnet_id}
-        subnets = vpc_conn.get_all_subnets(filters=filters)
+        subnets = self.get_subnets(subnet_id)
 
         if len(subnets) == 1:
             availability_zone = subnets[0].availability_zone
@@ -793,7 +767,7 @@ named {name}""".format(path=d['path'], name=d['name']))
     def establish_iam_connection(self):
 
         try:
-            self.iam = boto.connect_iam()
+            self.iam = connection_registry.get('iam')
             self.log.info('Established connection to IAM')
         except Exception, e:
             self.log.error(str(e))
@@ -802,34 +776,17 @@ named {name}""".format(path=d['path'], name=d['name']))
     def establish_route53_connection(self):
 
         try:
-            self.route53 = boto.route53.connect_to_region(self.region)
+            self.route53 = connection_registry.get('route53', self.region)
             self.log.info('Established connection to Route53')
         except Exception, e:
             self.log.error(str(e))
             raise e
 
     def get_security_group_ids(self, security_groups, vpc_id=None):
-            security_group_ids = []
-            for group in security_groups:
-                filters = {'group-name': group}
-
-                security_groups = [group for group in
-                                   self.ec2.get_all_security_groups(
-                                       filters=filters)
-                                   if self.vpc_id == group.vpc_id]
-
-                if len(security_groups) == 1:
-                    security_group_ids.append(security_groups[0].id)
-                elif len(security_groups) == 0:
-                    raise NoSecurityGroupsReturned(
-                        "No security group returned.")
-                else:
-                    raise MultipleSecurityGroupsReturned(
-                        "More than 1 security group returned")
-
-            return security_group_ids
+        return self.security_group_index.ids(security_groups, self.vpc_id)
 
-    def launch(self, wait=False):
+    @property
+    def launch_parameters(self):
         self.security_group_ids = self.get_security_group_ids(
             self.security_groups, self.vpc_id)
 
@@ -843,7 +800,6 @@ named {name}""".format(path=d['path'], name=d['name']))
             'key_name': self.keypair,
             'instance_type': self.instance_type,
             'block_device_map': self.blockdevicemapping,
-            'user_data': self.user_data,
             'ebs_optimized': self.ebs_optimized
         }
 
@@ -863,6 +819,30 @@ named {name}""".format(path=d['path'], name=d['name']))
                 'network_interfaces': interfaces
             })
 
+        return parameters
+
+    @property
+    def launch_key(self):
+        """
+        Servers with equal launch keys can be started in one reservation.
+        """
+
+        # The batch user data carries the Chef environment, server, validation
+        # key, run list and attributes, so only servers which agree on them
+        # may share it
+        return (self.__class__, self.region, self.ami, self.role,
+                self.keypair, self.instance_type, self.ebs_optimized,
+                self.subnet_id, self.availability_zone,
+                tuple(self.security_groups), repr(self.block_devices),
+                self.environment, self.chef_server_url, self.chef_path,
+                tuple(self.CHEF_RUNLIST),
+                json.dumps(self.CHEF_ATTRIBUTES, sort_keys=True))
+
+    @tracer.traced('launch')
+    def launch(self, wait=False, status_checks=False):
+        parameters = self.launch_parameters
+        parameters['user_data'] = self.user_data
+
         reservation = self.ec2.run_instances(**parameters)
 
         self.log.info('Successfully launched EC2 instance')
@@ -872,178 +852,214 @@ named {name}""".format(path=d['path'], name=d['name']))
         if wait:
             self.log.info('Waiting until the instance is running to return')
 
-            state = self.instance.state
-
-            while not(state == 'running'):
-                try:
-                    self.instance.update()
-                    state = self.instance.state
-                except Exception:
-                    pass
+            self.wait(status_checks=status_checks)
 
             self.log.info('The instance is running')
             return
 
+    @staticmethod
+    @tracer.traced('launch')
+    def launch_many(servers, wait=False, status_checks=False):
+        """
+        Launch configured servers, starting identical ones in a single
+        reservation. Each instance is tagged with its server's name as soon
+        as it exists; the shared user data reads the name from that tag.
+        """
+
+        Server.reserve_indexes(servers)
+
+        groups = {}
+
+        for server in servers:
+            groups.setdefault(server.launch_key, []).append(server)
+
+        for members in groups.values():
+            if len(members) == 1:
+                members[0].launch()
+                members[0].tag()
+                continue
+
+            first = members[0]
+
+            parameters = first.launch_parameters
+            parameters.update({
+                'user_data': first.batch_user_data,
+                'min_count': len(members),
+                'max_count': len(members)
+            })
+
+            reservation = first.ec2.run_instances(**parameters)
+
+            first.log.info('Successfully launched {count} EC2 instances in '
+                           'reservation {reservation}'.format(
+                               count=len(members), reservation=reservation.id))
+
+            for server, instance in zip(members, reservation.instances):
+                server.instance = instance
+                server.tag()
+
+        if wait:
+            Server.wait_for_all(servers, status_checks=status_checks)
+
+    def wait(self, status_checks=False):
+        Server.wait_for_all([self], status_checks=status_checks)
+
+    @staticmethod
+    @tracer.traced('wait')
+    def wait_for_all(servers, status_checks=False):
+        """
+        Wait for the instances of several launched servers together, then
+        refresh each server's instance attributes.
+        """
+
+        by_region = {}
+
+        for server in servers:
+            by_region.setdefault(server.region, []).append(server)
+
+        for members in by_region.values():
+            wait_for_instances(members[0].ec2,
+                               [server.instance.id for server in members],
+                               status_checks=status_checks)
+
+            for server in members:
+                server.instance.update()
+
+    @tracer.traced('tag')
     def tag(self):
+        tracer.current.set(instance=self.instance.id)
+
         self.ec2.create_tags([self.instance.id], self.tags)
         self.log.info('Tagged instance with {tags}'.format(tags=self.tags))
 
+        if self.NAME_AUTO_INDEX:
+            index_allocator.release(self.name_prefix, [self.index])
+
     @property
     def ephemeral_storage(self):
         return cloudspecs.aws.ec2.instances[self.instance_type]['instance_storage']
 
-    def route(self, wait=False):
+    @property
+    def dns_records(self):
+
+        formatting_params = {
+            'hostname': self.hostname,
+            'name': self.name,
+            'instance_id': self.instance.id,
+            'vpc_id': self.instance.vpc_id,
+            'ip_address': self.instance.ip_address,
+            'dns_name': self.instance.dns_name,
+            'private_ip_address': self.instance.private_ip_address,
+            'private_dns_name': self.instance.private_dns_name,
+            'dns_zone': self.hostname[len(self.name)+1:]
+        }
+
+        records = []
 
         for dns_zone in self.dns_zones:
 
-            self.log.info('Routing Hosted Zone {zone}'.format(zone=dns_zone))
-
-            for z in self.route53.get_zones():
-                if z.id == dns_zone['id'][self.environment]:
-                    zone = z
-                    break
+            zone_id = dns_zone['id'][self.environment]
 
-            self.log.info('Using Zone Address {zone}'.format(zone=zone.name))
+            for template in dns_zone['records']:
 
-            for record in dns_zone['records']:
+                record = dict(template)
+                record['name'] = template['name'].format(**formatting_params)
+                record['value'] = template['value'].format(
+                    **formatting_params)
 
-                self.log.info('Processing DNS record {record}'.format(
-                              record=record))
+                records.append((zone_id, record))
 
-                formatting_params = {
-                    'hostname': self.hostname,
-                    'name': self.name,
-                    'instance_id': self.instance.id,
-                    'vpc_id': self.instance.vpc_id,
-                    'ip_address': self.instance.ip_address,
-                    'dns_name': self.instance.dns_name,
-                    'private_ip_address': self.instance.private_ip_address,
-                    'private_dns_name': self.instance.private_dns_name,
-                    'dns_zone': self.hostname[len(self.name)+1:]
-                }
+        return records
 
-                record['name'] = record['name'].format(**formatting_params)
-                record['value'] = record['value'].format(**formatting_params)
+    @tracer.traced('route')
+    def route(self, wait=False, batch=None, tracker=None):
 
-                self.log.info('Adding DNS record {record}'.format(
-                              record=record))
+        commit = batch is None
 
-                existing_records = zone.find_records(name=record['name'],
-                                                     type=record['type'])
+        if commit:
+            batch = ChangeBatch(self.route53)
 
-                if existing_records:
-                    self.log.info('The DNS record already exists')
-                    zone.delete_record(existing_records)
-                    self.log.info('The existing DNS record was deleted')
+        for zone_id, record in self.dns_records:
 
-                try:
-                    status = zone.add_record(record['type'], record['name'],
-                                             record['value'],
-                                             ttl=record['ttl'])
-
-                    if wait:
-                        while status.update() != 'INSYNC':
-                            self.log.debug('Waiting for DNS '
-                                           'change to propagate')
-                            time.sleep(10)
-
-                    self.log.info('Added new DNS record')
-                except Exception, e:
-                    self.log.error(str(e))
-                    raise e
+            self.log.info('Adding DNS record {record} to Hosted Zone '
+                          '{zone}'.format(record=record, zone=zone_id))
 
-    def ingress_rules(self):
-        grp_id = self.get_security_group_ids([self.envcl], vpc_id=self.vpc_id)
-        main_group = self.ec2.get_all_security_groups(group_ids=grp_id)
-        for ing in self.ingress_groups_to_add:
-            self.log.info('Adding ingress rules for group: {0}'
-                          .format(ing))
-            grp_id = self.get_security_group_ids([ing], vpc_id=self.vpc_id)
-            grp_obj = self.ec2.get_all_security_groups(group_ids=grp_id[0])[0]
-            for port in self.ports_to_authorize:
-                self.log.info("Adding port {0} from {1} to {2}.".format(
-                    port, ing, main_group[0]))
-                try:
-                    main_group[0].authorize(ip_protocol='tcp',
-                                            from_port=port,
-                                            to_port=port,
-                                            src_group=grp_obj)
-                except boto.exception.EC2ResponseError as e:
-                    self.log.warning(
-                        "Unable to add ingress rule. May already exist. ")
+            batch.upsert(zone_id, record['name'], record['type'],
+                         record['value'], ttl=record['ttl'])
 
-    @property
-    def connection(self):
+        if not commit:
+            return
 
         try:
-            connection = self.ssh_connection
-
-            self.log.info('Determining is SSH transport is still active')
-            transport = connection.get_transport()
-
-            if not transport.is_active():
-                self.log.warn('SSH transport is no longer active')
-                self.log.info('Proceeding to re-establish SSH connection')
-                raise Exception()
-
-            else:
-                self.log.info('SSH transport is still active')
-                return connection
-        except Exception:
-            pass
+            change_ids = batch.commit()
+        except Exception, e:
+            self.log.error(str(e))
+            raise e
 
-        connection = SSHClient()
-        connection.set_missing_host_key_policy(AutoAddPolicy())
+        if tracker is not None:
+            tracker.add(change_ids)
+        elif wait:
+            wait_for_changes(self.route53, change_ids)
 
-        self.log.info('Attempting to establish SSH connection')
+        self.log.info('Added new DNS records')
 
-        while True:
-            try:
-                keys = ['~/.ssh/stage', '~/.ssh/prod']
-                keys = [os.path.expanduser(key) for key in keys]
+        return change_ids
 
-                connection.connect(self.instance.private_dns_name,
-                                   username='ec2-user',
-                                   key_filename=keys)
-                break
-            except Exception as err:
-                self.log.warn('Unable to establish SSH connection ' + str(err))
-                time.sleep(10)
+    @staticmethod
+    @tracer.traced('route')
+    def route_all(servers, wait=False, tracker=None):
+        """
+        Route several launched servers with one change per hosted zone.
+        With a tracker, the changes are added to it instead of waited on.
+        """
 
-        self.log.info('Successfully established SSH connection')
+        servers = [server for server in servers if server.add_route53_dns]
 
-        self.ssh_connection = connection
+        if not servers:
+            return []
 
-        return connection
+        batch = ChangeBatch(servers[0].route53)
 
-    def run(self, command):
+        for server in servers:
+            server.route(batch=batch)
 
-        with self.connection as conn:
+        change_ids = batch.commit()
 
-            state = {
-                'in': None,
-                'out': None,
-                'err': None
-            }
+        if tracker is not None:
+            tracker.add(change_ids)
+        elif wait:
+            wait_for_changes(servers[0].route53, change_ids)
 
-            stdin, stdout, stderr = conn.exec_command(command)
+        return change_ids
 
-            try:
-                state['in'] = stdin.read()
-            except IOError:
-                pass
+    def ingress_rules(self):
+        index = self.security_group_index
+        main_group = index.get(self.envcl, self.vpc_id)
+        for ing in self.ingress_groups_to_add:
+            self.log.info('Adding ingress rules for group: {0}'
+                          .format(ing))
+            grp_obj = index.get(ing, self.vpc_id)
+            for port in self.ports_to_authorize:
+                self.log.info("Adding port {0} from {1} to {2}.".format(
+                    port, ing, main_group))
+                try:
+                    main_group.authorize(ip_protocol='tcp',
+                                         from_port=port,
+                                         to_port=port,
+                                         src_group=grp_obj)
+                except boto.exception.EC2ResponseError as e:
+                    self.log.warning(
+                        "Unable to add ingress rule. May already exist. ")
 
-            try:
-                state['out'] = stdout.read()
-            except IOError:
-                pass
+    def run(self, command):
 
-            try:
-                state['err'] = stderr.read()
-            except IOError:
-                pass
+        stdout, stderr = ssh_pool.run(self.instance.private_dns_name, command)
 
-            return state
+        return {
+            'in': None,
+            'out': stdout,
+            'err': stderr
+        }
 
     def terminate(self):
         """
@@ -1069,6 +1085,7 @@ named {name}""".format(path=d['path'], name=d['name']))
             self.log.info('Failed to terminate {instance}'.format(
                 instance=instance_id))
 
+    @tracer.traced('bake')
     def bake(self):
         if self.CHEF_RUNLIST:
             chef_path = os.path.expanduser(self.chef_path)
@@ -1115,53 +1132,140 @@ named {name}""".format(path=d['path'], name=d['name']))
                     self.log.error(str(e))
                     raise e
 
-    def baked(self):
+    CHEF_LOG = '/var/log/chef-client.log'
+
+    # How long baked() waits for the Chef Client run to finish, in seconds
+    CHEF_TIMEOUT = 2 * 60 * 60
+
+    # chef-client's own log lines, such as
+    # [2016-01-01T00:00:00+00:00] INFO: Chef Run complete in 35.2 seconds
+    CHEF_STARTED = re.compile(r'^\[[^\]]+\] INFO: Starting Chef Run for ')
+    CHEF_SUCCEEDED = re.compile(r'^\[[^\]]+\] INFO: Chef Run complete in ')
+    CHEF_FAILED = re.compile(r'^\[[^\]]+\] (ERROR: Exception handlers '
+                             r'complete|FATAL: Stacktrace dumped to )')
+
+    # Written after the log once chef-client is no longer running
+    CHEF_EXITED = 'tyr: chef-client is not running'
+
+    def chef_result(self, cancel=None, deadline=None):
+        """
+        Follow the Chef Client log as it is written, returning True or False
+        as soon as the run completes or fails, or False if chef-client
+        exits without doing either. Returns None if the stream ends, or
+        `cancel` is set or `deadline` passes, first.
+        """
+
+        recent = collections.deque(maxlen=20)
+        started = False
+
+        # Waits for chef-client or its log to appear, then follows the log
+        # from the start of the latest run, so a run which finished before
+        # the log was opened is still seen, and one left over from an
+        # earlier run is not. tail stops once chef-client exits, whether or
+        # not it got as far as logging the outcome.
+        command = ("until pgrep chef-client >/dev/null || [ -f {log} ]; do "
+                   "sleep 5; done; "
+                   "start=$(grep -n 'INFO: Starting Chef Run for ' {log} "
+                   "2>/dev/null | tail -n 1 | cut -d: -f1); "
+                   "pid=$(pgrep -o chef-client); "
+                   "if [ -n \"$pid\" ]; then "
+                   "tail -n +${{start:-1}} --pid=$pid -F {log} 2>/dev/null; "
+                   "else tail -n +${{start:-1}} {log} 2>/dev/null; fi; "
+                   "echo; echo '{exited}'").format(log=self.CHEF_LOG,
+                                                  exited=self.CHEF_EXITED)
+
+        with contextlib.closing(ssh_pool.lines(self.instance.private_dns_name,
+                                               command, interval=10)) as lines:
+            for line in lines:
+                if cancel is not None and cancel.is_set():
+                    return None
+
+                if deadline is not None and time.time() >= deadline:
+                    return None
+
+                if line is None:
+                    continue
+
+                if line.rstrip('\n') == self.CHEF_EXITED:
+                    self.log.info('Chef Client exited without finishing its '
+                                  'run')
+                    self.log.debug(''.join(recent))
+                    return False
+
+                if self.CHEF_STARTED.match(line):
+                    recent.clear()
+
+                recent.append(line)
+
+                if not started:
+                    started = True
+                    self.log.info('Chef Client has started')
+                    self.log.info('Waiting for Chef Client to finish')
+
+                if self.CHEF_SUCCEEDED.match(line):
+                    self.log.info('Chef Client was successful')
+                    return True
+
+                if self.CHEF_FAILED.match(line):
+                    self.log.info('Chef Client was not successful')
+                    self.log.debug(''.join(recent))
+                    return False
+
+    @tracer.traced('baked')
+    def baked(self, cancel=None):
         if self.CHEF_RUNLIST:
+            tracer.current.set(host=self.hostname)
+
             self.log.info('Determining status of "{node}"'.format(
                           node=self.hostname))
 
             self.log.info('Waiting for Chef Client to start')
 
-            while True:
-                r = self.run('ls -l /var/log')
+            deadline = time.time() + self.CHEF_TIMEOUT
 
-                if 'chef-client.log' in r['out']:
-                    break
-                else:
-                    time.sleep(10)
-
-            self.log.info('Chef Client has started')
+            # Once `cancel` is set, nobody is waiting on the result
+            while cancel is None or not cancel.is_set():
+                try:
+                    result = self.chef_result(cancel, deadline)
+                except SSHException as e:
+                    self.log.warn(str(e))
+                    result = None
 
-            self.log.info('Waiting for Chef Client to finish')
+                if result is not None:
+                    return result
 
-            while True:
-                r = self.run('pgrep chef-client')
+                if time.time() >= deadline:
+                    self.log.error('Chef Client did not finish within '
+                                   '{timeout} seconds'.format(
+                                       timeout=self.CHEF_TIMEOUT))
+                    return False
 
-                if len(r['out']) > 0:
-                    time.sleep(10)
-                else:
+                if cancel is not None and cancel.is_set():
                     break
 
-            self.log.info('Chef Client has finished')
-
-            self.log.info('Determining Node state')
+                self.log.warn('Lost the Chef Client log stream; reconnecting')
 
-            r = self.run('tail /var/log/chef-client.log')
+                if cancel is not None:
+                    cancel.wait(10)
+                else:
+                    time.sleep(10)
 
-            if 'Chef Run complete in' in r['out']:
-                self.log.info('Chef Client was successful')
-                return True
-            else:
-                self.log.info('Chef Client was not successful')
-                self.log.debug(r['out'])
-                return False
+            self.log.info('Stopped waiting for Chef Client')
+            return False
 
+    @api_account.accounted
     def autorun(self):
 
         self.establish_logger()
-        self.configure()
-        self.launch(wait=True)
-        self.tag()
-        if self.add_route53_dns:
-            self.route()
-        self.bake()
+
+        with tracer.span('autorun', server=self.__class__.__name__) as span:
+            if not self.configured:
+                with tracer.span('configure'):
+                    self.configure()
+            if self.instance is None:
+                self.launch(wait=True)
+                span.set(instance=self.instance.id)
+                self.tag()
+            if self.add_route53_dns:
+                self.route()
+            self.bake()
@@ -1,11 +1,14 @@
 from tyr.utilities.replace_mongo_server import (ReplicaSet, run_command,
-                                                run_mongo_command, timeit)
+                                                timeit)
+from tyr.helpers import mongo_admin, for_each, ssh_pool
 
-import time
+import hashlib
 import logging
 import os
+import requests
 import sys
 import pprint
+import threading
 
 
 log = logging.getLogger('Tyr.Utilities.CompactMongoCollection')
@@ -22,22 +25,22 @@ if not log.handlers:
 
 @timeit
 def validate_sync_to(replica_set):
+    status = replica_set.status
+
     log.debug('Replica set status')
-    for line in pprint.pformat(replica_set.status).split('\n'):
+    for line in pprint.pformat(status).split('\n'):
         log.debug(line)
 
     log.debug('Retrieving list of secondaries')
 
-    nodes = [node for node in replica_set.status['members']
-             if node['stateStr'] == 'SECONDARY']
+    nodes = status.in_state('SECONDARY')
 
     log.debug('Secondaries: {secondaries}'.format(
         secondaries=[n['name'] for n in nodes]))
 
     log.debug('Retrieving the primary')
 
-    primary = [node for node in replica_set.status['members']
-               if node['stateStr'] == 'PRIMARY'][0]
+    primary = status.primary
 
     log.debug('Primary: {primary}'.format(primary=primary['name']))
 
@@ -52,22 +55,22 @@ def validate_sync_to(replica_set):
 
 @timeit
 def enforce_sync_to(replica_set):
+    status = replica_set.status
+
     log.debug('Replica set status')
-    for line in pprint.pformat(replica_set.status).split('\n'):
+    for line in pprint.pformat(status).split('\n'):
         log.debug(line)
 
     log.debug('Retrieving list of secondaries')
 
-    nodes = [node for node in replica_set.status['members']
-             if node['stateStr'] == 'SECONDARY']
+    nodes = status.in_state('SECONDARY')
 
     log.debug('Secondaries: {secondaries}'.format(
         secondaries=[n['name'] for n in nodes]))
 
     log.debug('Retrieving the primary')
 
-    primary = [node for node in replica_set.status['members']
-               if node['stateStr'] == 'PRIMARY'][0]
+    primary = status.primary
 
     log.debug('Primary: {primary}'.format(primary=primary['name']))
 
@@ -77,55 +80,101 @@ def enforce_sync_to(replica_set):
         log.warning('{node} is syncing to {target}'.format(
             node=node['name'],
             target=node['syncingTo']))
-        command = 'rs.syncFrom(\'{primary}:27018\')'.format(
-            primary=replica_set.primary)
-        log.info('Correcting using rs.syncFrom')
-        run_mongo_command(node['name'].split(':')[0], command)
+        log.info('Correcting using replSetSyncFrom')
+        mongo_admin(node['name'].split(':')[0]).sync_from(
+            '{primary}:27018'.format(primary=replica_set.primary))
+
+    replica_set.invalidate()
 
     log.debug('Replica set status')
     for line in pprint.pformat(replica_set.status).split('\n'):
         log.debug(line)
 
 
-@timeit
-def fetch_script(host, version):
-    log.debug('Removing compact.js if it exists')
-    run_command(host, 'rm -rf /home/ec2-user/compact.js')
+SCRIPT_URI = ('https://s3.amazonaws.com/hudl-chef-artifacts/mongodb/'
+              'compact-{version}.js')
+SCRIPT_CACHE = '~/.tyr/cache'
+SCRIPT_PATH = '/home/ec2-user/compact.js'
 
-    uri = 'https://s3.amazonaws.com/hudl-chef-artifacts/mongodb/compact-{v}.js'
-    uri = uri.format(v=version)
+script_lock = threading.Lock()
 
-    log.debug('Retrieving compact.js from {uri}'.format(uri=uri))
 
-    command = 'curl -o /home/ec2-user/compact.js {uri}'.format(uri=uri)
+def cached_script(version):
+    """
+    Download compact.js for `version` once, returning its local path.
+    """
 
-    run_command(host, command)
+    directory = os.path.expanduser(SCRIPT_CACHE)
+    path = os.path.join(directory, 'compact-{version}.js'.format(
+        version=version))
 
+    with script_lock:
+        if os.path.exists(path):
+            return path
 
-@timeit
-def compact(host):
-    log.debug('Running compact.js on {host}'.format(host=host))
-    run_command(host, 'mongo --port 27018 /home/ec2-user/compact.js')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        uri = SCRIPT_URI.format(version=version)
+
+        log.debug('Retrieving compact.js from {uri}'.format(uri=uri))
+
+        response = requests.get(uri)
+        response.raise_for_status()
+
+        # Written aside and renamed, so an interrupted download is never
+        # mistaken for the script
+        with open(path + '.tmp', 'wb') as f:
+            f.write(response.content)
+
+        os.rename(path + '.tmp', path)
+
+    return path
+
+
+def checksum(path):
+
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
 
 
 @timeit
-def recovering(replica_set, host):
-    log.debug('Confirming {host} is finished recovering'.format(host=host))
+def fetch_script(host, version):
 
-    nodes = replica_set.status['members']
-    recovering = True
+    path = cached_script(version)
 
-    for node in nodes:
-        if node['name'] == host:
-            if node['stateStr'] != 'RECOVERING':
-                recovering = False
+    output = run_command(host, 'md5sum {path} 2>/dev/null'.format(
+                         path=SCRIPT_PATH)) or ''
+
+    if output.split(' ')[0] == checksum(path):
+        log.debug('compact.js on {host} is up to date'.format(host=host))
+        return
+
+    log.debug('Pushing compact.js to {host}'.format(host=host))
+    ssh_pool.put(host, path, SCRIPT_PATH)
 
-    if recovering:
-        log.debug('{host} is still recovering'.format(host=host))
-    else:
-        log.debug('{host} has finished recovering'.format(host=host))
 
-    return recovering
+def distribute_script(hosts, version):
+    """
+    Make sure every host has compact.js for `version`, pushing it to all
+    of them at once.
+    """
+
+    results, errors = for_each(lambda host: fetch_script(host, version),
+                               hosts)
+
+    for host, error in errors:
+        log.critical('Unable to push compact.js to {host}: {error}'.format(
+                     host=host, error=error))
+
+    if errors:
+        sys.exit(1)
+
+
+@timeit
+def compact(host):
+    log.debug('Running compact.js on {host}'.format(host=host))
+    run_command(host, 'mongo --port 27018 /home/ec2-user/compact.js')
 
 
 @timeit
@@ -140,8 +189,129 @@ def id_for_host(host):
     return instance_id
 
 
+class QuorumGuard(object):
+    """
+    Decides which secondaries may be taken out of service for compaction
+    at the same time. A voting secondary may only start compacting if at
+    least `min_healthy_secondaries` other voting secondaries stay healthy,
+    and the primary and healthy voting secondaries together remain a
+    majority of the votes, so majority writes can still be acknowledged.
+
+    Small sets, such as a primary and one secondary or a primary, secondary
+    and arbiter, can never satisfy that. A member that is refused while
+    nothing else is compacting is compacted on its own, as before, unless
+    `require_quorum` is set, in which case compaction fails instead.
+    """
+
+    def __init__(self, replica_set, min_healthy_secondaries=1,
+                 require_quorum=False):
+
+        self.replica_set = replica_set
+        self.min_healthy_secondaries = min_healthy_secondaries
+        self.require_quorum = require_quorum
+
+        self.compacting = set()
+        self.condition = threading.Condition()
+
+    def votes(self):
+
+        config = mongo_admin(self.replica_set.primary).config()
+
+        return dict((member['host'], member.get('votes', 1))
+                    for member in config['members'])
+
+    def allows(self, name):
+
+        votes = self.votes()
+
+        if not votes.get(name, 1):
+            return True
+
+        status = self.replica_set.refresh()
+
+        healthy = [member['name'] for member in status.in_state('SECONDARY')
+                   if votes.get(member['name'], 1) and
+                   member['name'] not in self.compacting and
+                   member['name'] != name]
+
+        if len(healthy) < self.min_healthy_secondaries:
+            return False
+
+        primary = status.primary
+        acknowledging = len(healthy) + (1 if primary is not None and
+                                        votes.get(primary['name'], 1) else 0)
+
+        majority = sum(1 for vote in votes.values() if vote) / 2 + 1
+
+        return acknowledging >= majority
+
+    def acquire(self, name):
+
+        with self.condition:
+            while not self.allows(name):
+                if not self.compacting:
+                    if self.require_quorum:
+                        raise Exception(
+                            'Compacting {name} would leave too few healthy '
+                            'voting members'.format(name=name))
+
+                    log.warning('Compacting {name} would leave too few '
+                                'healthy voting members; compacting it on '
+                                'its own'.format(name=name))
+                    break
+
+                log.debug('Waiting for another member to recover before '
+                          'compacting {name}'.format(name=name))
+                self.condition.wait(30)
+
+            self.compacting.add(name)
+
+    def release(self, name):
+
+        with self.condition:
+            self.compacting.discard(name)
+            self.condition.notify_all()
+
+
+def compact_members(replica_set, members, guard, parallelism=None):
+
+    def compact_member(member):
+
+        address = member['name'].split(':')[0]
+
+        guard.acquire(member['name'])
+
+        try:
+            log.info('Compacting {host}'.format(host=address))
+            compact(address)
+
+            log.info('Waiting for {host} to recover'.format(host=address))
+            replica_set.watcher(timeout=None).wait_for_member(member['name'],
+                                                              'SECONDARY')
+        finally:
+            guard.release(member['name'])
+
+    results, errors = for_each(compact_member, members,
+                               workers=parallelism or len(members) or 1)
+
+    for member, error in errors:
+        log.critical('Compacting {host} failed: {error}'.format(
+                     host=member['name'], error=error))
+
+    if errors:
+        sys.exit(1)
+
+
 @timeit
-def compact_mongodb_server(host, version, prompt_before_failover=True):
+def compact_mongodb_server(host, version, prompt_before_failover=True,
+                           parallelism=None, min_healthy_secondaries=1,
+                           require_quorum=False):
+    """
+    Compact every member of the replica set `host` belongs to. Secondaries
+    are compacted together, up to `parallelism` at a time, as far as the
+    QuorumGuard allows. Members the guard refuses are compacted one at a
+    time unless `require_quorum` is set.
+    """
 
     log.debug('Retrieving replica set for host {host}'.format(host=host))
     replica_set = ReplicaSet(host)
@@ -153,30 +323,27 @@ def compact_mongodb_server(host, version, prompt_before_failover=True):
 
     log.debug('Validation of syncingTo property on nodes complete')
 
-    secondaries = [node for node in replica_set.status['members']
-                   if node['stateStr'] == 'SECONDARY']
+    guard = QuorumGuard(replica_set, min_healthy_secondaries,
+                        require_quorum)
 
-    log.info('Compacting {nodes}'.format(
-        nodes=[s['name'] for s in secondaries]))
+    # The primary is compacted too once it has failed over
+    members = (replica_set.status.in_state('PRIMARY') +
+               replica_set.status.in_state('SECONDARY'))
 
-    for secondary in secondaries:
-        address = secondary['name'].split(':')[0]
+    log.info('Distributing compact.js to {count} members'.format(
+             count=len(members)))
+    distribute_script([member['name'].split(':')[0] for member in members],
+                      version)
 
-        log.debug('Retrieving compact.js on {host}'.format(host=address))
-        fetch_script(address, version)
+    secondaries = replica_set.status.in_state('SECONDARY')
 
-        log.info('Compacting {host}'.format(host=address))
-        compact(address)
+    log.info('Compacting {nodes}'.format(
+        nodes=[s['name'] for s in secondaries]))
 
-        log.info('Waiting for {host} to recover'.format(host=address))
-        while recovering(replica_set, secondary['name']):
-            log.warning('{host} is still recovering.'.format(host=address))
-            log.debug('Sleeping for 30 seconds.')
-            time.sleep(30)
+    compact_members(replica_set, secondaries, guard, parallelism)
 
     log.debug('Retrieving current primary')
-    secondaries = [node for node in replica_set.status['members']
-                   if node['stateStr'] == 'PRIMARY']
+    secondaries = replica_set.status.in_state('PRIMARY')
 
     log.debug('Preparing to compact primary {host}'.format(
         host=secondaries[0]['name']))
@@ -197,17 +364,4 @@ def compact_mongodb_server(host, version, prompt_before_failover=True):
 
     log.debug('Validation of syncingTo property on nodes complete')
 
-    for secondary in secondaries:
-        address = secondary['name'].split(':')[0]
-
-        log.debug('Retrieving compact.js on {host}'.format(host=address))
-        fetch_script(address, version)
-
-        log.info('Compacting {host}'.format(host=address))
-        compact(address)
-
-        log.info('Waiting for {host} to recover'.format(host=address))
-        while recovering(replica_set, secondary['name']):
-            log.warning('{host} is still recovering.'.format(host=address))
-            log.debug('Sleeping for 30 seconds.')
-            time.sleep(30)
\ No newline at end of file
+    compact_members(replica_set, secondaries, guard, parallelism)
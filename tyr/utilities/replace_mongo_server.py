@@ -1,29 +1,25 @@
+import collections
 import os
 import sys
+import threading
 from tyr.servers.mongo import MongoDataNode, MongoDataWarehousingNode, \
     MongoArbiterNode
-import json
 import time
-from paramiko.client import AutoAddPolicy, SSHClient
 import requests
-import boto.ec2
-import boto.route53
 import logging
+from tyr.helpers import (ChangeBatch, ReplicaSetStatus, ReplicaSetWatcher,
+                         SyncProgress, member_in_state, member_absent,
+                         primary_other_than, responding, ssh_pool,
+                         mongo_admin, for_each, tracer,
+                         connection_registry)
+from tyr.servers.exceptions import ReplicaSetWaitTimeout
 
-def timeit(method):
 
-    def timed(*args, **kwargs):
-        start = time.time()
-        response = method(*args, **kwargs)
-        end = time.time()
+# Each call of a decorated function is recorded as a tracing span
+timeit = tracer.traced()
 
-        log.debug('Executed {name} in {elapsed} seconds'.format(
-                                                        name=method.__name__,
-                                                        elapsed=end-start))
-
-        return response
-
-    return timed
+# Held while asking for confirmation, so one prompt is answered at a time
+prompt_lock = threading.Lock()
 
 log = logging.getLogger('Tyr.Utilities.ReplaceMongoServer')
 if not log.handlers:
@@ -37,11 +33,23 @@ if not log.handlers:
     log.addHandler(ch)
 
 
+# Deadlines, in seconds, for replica set changes to take effect
+ELECTION_TIMEOUT = 300
+REMOVAL_TIMEOUT = 120
+STARTUP_TIMEOUT = 300
+
+
 class ReplicaSet(object):
 
+    name = None
     primary = None
 
-    def __init__(self, member):
+    def __init__(self, member, ttl=5):
+
+        # Status snapshots are reused for up to `ttl` seconds, and dropped
+        # whenever tyr changes the replica set
+        self.ttl = ttl
+        self.snapshot = None
 
         log.debug('Determing the primary for the replica set')
         self.determine_primary(member)
@@ -49,8 +57,8 @@ class ReplicaSet(object):
     @timeit
     def determine_primary(self, member):
 
-        log.debug('Using db.isMaster() to determine the primary')
-        response = run_mongo_command(member, 'db.isMaster()')
+        log.debug('Using isMaster to determine the primary')
+        response = mongo_admin(member).is_master()
 
         try:
             primary = response['primary'].split(':')[0]
@@ -67,20 +75,42 @@ class ReplicaSet(object):
             log.critical('The primary property is not a string.')
             sys.exit(1)
 
+        if primary != self.primary:
+            self.invalidate()
+
+        self.name = response.get('setName', self.name)
         self.primary = primary
 
         log.debug('The primary is {primary}'.format(primary=self.primary))
 
     @property
-    @timeit
     def status(self):
 
-        log.debug('Retrieving the replica set\'s status using rs.status()')
-        status = run_mongo_command(self.primary, 'rs.status()')
+        if self.snapshot is None or self.snapshot.age > self.ttl:
+            self.refresh()
+
+        return self.snapshot
+
+    @timeit
+    def refresh(self):
+
+        log.debug('Retrieving the replica set\'s status using '
+                  'replSetGetStatus')
+        status = mongo_admin(self.primary).status()
 
         log.debug('The status is {status}'.format(status=status))
 
-        return status
+        self.snapshot = ReplicaSetStatus(status)
+
+        return self.snapshot
+
+    def invalidate(self):
+
+        self.snapshot = None
+
+    def watcher(self, **kwargs):
+
+        return ReplicaSetWatcher(self.refresh, **kwargs)
 
     @property
     @timeit
@@ -90,9 +120,8 @@ class ReplicaSet(object):
 
         arbiter = None
 
-        for member in self.status['members']:
-            if member['stateStr'] == 'ARBITER':
-                arbiter = member['name'][:-6]
+        for member in self.status.in_state('ARBITER'):
+            arbiter = member['name'][:-6]
 
         if arbiter is None:
             log.debug('The replica set does not have an arbiter')
@@ -112,10 +141,12 @@ class ReplicaSet(object):
         member = self.primary
 
         log.debug('Telling the primary to step down')
-        run_mongo_command(self.primary, 'rs.stepDown()')
+        mongo_admin(self.primary).step_down()
+        self.invalidate()
 
-        log.debug('Sleeping for 120 seconds while an election takes place')
-        time.sleep(120)
+        log.debug('Waiting for an election to take place')
+        self.watcher(timeout=ELECTION_TIMEOUT).wait_until(
+            primary_other_than(member))
 
         log.debug('Determing the new primary')
         self.determine_primary(member)
@@ -142,6 +173,10 @@ class ReplicaSet(object):
                                                         address=address))
             run_command(address, 'sudo service mongod start')
 
+            log.debug('Waiting for mongod to accept connections')
+            wait_until_responding(address if accessible is None
+                                  else accessible)
+
         else:
             log.debug('mongod is already running on {address}'.format(
                                                         address=address))
@@ -151,21 +186,9 @@ class ReplicaSet(object):
 
         name = '{address}:27018'.format(address=address)
 
-        command = 'rs.add(\'{name}\')'.format(name=name)
-
-        if arbiter:
-            command = 'rs.addArb(\'{name}\')'.format(name=name)
-
-        if hidden:
-            ids = [int(member['_id']) for member in self.status['members']]
-
-            id_ = max(ids) + 1
-
-            command = ('rs.add({{_id:{id_}, host:\'{name}\', priority:0, '
-                       'hidden: true}})').format(id_=id_, name=name)
-
-        log.debug('Using the command {command}'.format(command=command))
-        response = run_mongo_command(self.primary, command)
+        response = mongo_admin(self.primary).add_member(name, arbiter=arbiter,
+                                                        hidden=hidden)
+        self.invalidate()
 
         log.debug('Received response {response}'.format(response=response))
 
@@ -188,26 +211,17 @@ class ReplicaSet(object):
 
         name = '{address}:27018'.format(address=address)
 
-        command = 'rs.remove(\'{name}\')'.format(name=name)
-
-        log.debug('Using the command {command}'.format(command=command))
-        response = run_mongo_command(self.primary, command)
+        response = mongo_admin(self.primary).remove_member(name)
+        self.invalidate()
 
         log.debug('Received response {response}'.format(response=response))
 
-        log.debug('Sleeping for 20 seconds')
-        time.sleep(20)
-
-        isMember = False
-
         log.debug('Confirming that the node has been removed')
 
-        for member in self.status['members']:
-            if member['name'] == name:
-                isMember = True
-                break
-
-        if isMember:
+        try:
+            self.watcher(timeout=REMOVAL_TIMEOUT).wait_until(
+                member_absent(name))
+        except ReplicaSetWaitTimeout:
             log.critical('The node is still a member of the replica set')
             sys.exit(1)
 
@@ -217,73 +231,26 @@ class ReplicaSet(object):
             run_command(address, 'sudo rm -rf /volr/*')
 
 
-@timeit
-def run_command(address, command):
+def wait_until_responding(address):
 
-    connection = SSHClient()
-    connection.set_missing_host_key_policy(AutoAddPolicy())
+    ReplicaSetWatcher(mongo_admin(address).is_master,
+                      timeout=STARTUP_TIMEOUT).wait_until(responding)
 
-    while True:
-        try:
-            keys = ['~/.ssh/stage', '~/.ssh/prod']
-            keys = [os.path.expanduser(key) for key in keys]
 
-            connection.connect(address, username='ec2-user',
-                               key_filename=keys)
-            break
-        except Exception:
-            log.warn('Unable to establish an SSH connection')
-            log.debug('Retrying in 10 seconds')
-            time.sleep(10)
+@timeit
+def run_command(address, command):
 
-    log.debug('Established an SSH connection')
     log.debug('Running {command} on {address}'.format(command=command,
                                                       address=address))
 
-    stdin, stdout, stderr = connection.exec_command(command)
-
-    try:
-        stdin = stdin.read()
-    except IOError:
-        stdin = None
-
-    try:
-        stdout = stdout.read()
-    except IOError:
-        stdout = None
-
-    try:
-        stderr = stderr.read()
-    except IOError:
-        stderr = None
+    stdout, stderr = ssh_pool.run(address, command)
 
-    log.debug('STDIN: {stdin}'.format(stdin=stdin))
     log.debug('STDOUT: {stdout}'.format(stdout=stdout))
     log.debug('STDERR: {stderr}'.format(stderr=stderr))
 
     return stdout
 
 
-@timeit
-def run_mongo_command(address, command):
-
-    log.debug('Running the mongo command {command} on {address}'.format(
-                                                        command=command,
-                                                        address=address))
-
-    template = 'mongo --port 27018 --eval "JSON.stringify({command})"'
-    command = template.format(command=command)
-
-    response = run_command(address, command)
-
-    log.debug('Received response {response}'.format(response=response))
-
-    try:
-        return json.loads(response.split('\n')[2])
-    except ValueError:
-        return response
-
-
 @timeit
 def launch_server(environment, group, subnet_id, instance_type,
                   availability_zone, replica_set, data_volume_size,
@@ -349,36 +316,57 @@ def wait_for_sync(node):
 
     log.debug('Waiting for the node to finish syncing')
 
-    while True:
-
-        status = run_mongo_command(node.instance.private_dns_name,
-                                   'rs.status()')
+    # The initial sync can take hours, so there is no deadline
+    admin = mongo_admin(node.instance.private_dns_name)
+    progress = SyncProgress(node.hostname)
 
-        if status['ok'] != 1:
+    while True:
+        try:
+            status = admin.status(initial_sync=True)
+        except Exception as e:
+            log.debug('Unable to retrieve the sync status: {error}'.format(
+                      error=e))
+            time.sleep(progress.interval())
+            continue
 
-            log.debug('The replica set is not okay')
-            log.debug('Trying again in 30 seconds')
+        if member_in_state(node.hostname, 'SECONDARY')(status):
+            break
 
-            time.sleep(30)
+        primary = ReplicaSetStatus(status).primary
 
-            continue
+        if progress.total_bytes is None and primary is not None:
+            try:
+                progress.total_bytes = mongo_admin(
+                    primary['name'].split(':')[0]).data_size()
+                log.debug('The primary holds {size} bytes of data'.format(
+                          size=progress.total_bytes))
+            except Exception as e:
+                log.debug('Unable to size the primary\'s data: {error}'
+                          .format(error=e))
+                progress.total_bytes = 0
+
+        copied = None
+
+        if 'initialSyncStatus' not in status:
+            # Without the initial sync counters, compare the data the member
+            # holds with the primary's. Members may refuse dbStats while
+            # they sync.
+            try:
+                copied = admin.data_size()
+            except Exception as e:
+                log.debug('Unable to size the node\'s data: {error}'.format(
+                          error=e))
 
-        state = ''
+        progress.update(status, copied)
 
-        for member in status['members']:
-            try:
-                if member['self']:
-                    state = member['stateStr']
-                    break
-            except KeyError:
-                pass
+        interval = progress.interval()
 
-        if state == 'SECONDARY':
-            break
+        log.info('{node}: {progress}; checking again in {interval:.0f} '
+                 'seconds'.format(node=node.hostname,
+                                  progress=progress.describe(),
+                                  interval=interval))
 
-        log.debug('The node has not finished syncing yet')
-        log.debug('Trying again in 60 seconds')
-        time.sleep(60)
+        time.sleep(interval)
 
     log.debug('The node has finished syncing')
 
@@ -396,7 +384,7 @@ def stop_decommissioned_node(address, terminate=False):
     log.debug('The instance ID is {id_}'.format(id_=instance_id))
 
     log.debug('Establishing a connection to AWS EC2 us-east-1')
-    conn = boto.ec2.connect_to_region('us-east-1')
+    conn = connection_registry.get('ec2', 'us-east-1')
 
     if terminate:
         log.debug('Terminating {instance}'.format(instance=instance_id))
@@ -451,7 +439,7 @@ def replace_server(environment=None, group=None, subnet_id=None,
         log.info('To continue, the replica set must be failed over')
 
         log.debug('Connecting to AWS EC2 us-east-1')
-        conn = boto.ec2.connect_to_region('us-east-1')
+        conn = connection_registry.get('ec2', 'us-east-1')
         log.debug('Connected to AWS EC2 us-east-1')
 
         components = replica_set.primary.split('-')
@@ -496,10 +484,12 @@ def replace_server(environment=None, group=None, subnet_id=None,
                                                     address=public_address))
 
         log.debug('Instructing the primary to step down')
-        run_mongo_command(public_address, 'rs.stepDown()')
+        mongo_admin(public_address).step_down()
 
-        log.debug('Sleeping for 120 seconds while an election takes place')
-        time.sleep(120)
+        log.debug('Waiting for an election to take place')
+        ReplicaSetWatcher(mongo_admin(public_address).status,
+                          timeout=ELECTION_TIMEOUT).wait_until(
+                              primary_other_than(old_primary))
 
         log.debug('Determining the new primary')
         replica_set.determine_primary(member)
@@ -508,9 +498,6 @@ def replace_server(environment=None, group=None, subnet_id=None,
                   'the replica set')
         replica_set.remove_member(old_primary)
 
-        log.debug('Sleeping for 120 seconds')
-        time.sleep(120)
-
         log.debug('Adding the old primary back into the replica '
                   'set with the new address')
         replica_set.add_member(public_address)
@@ -598,8 +585,12 @@ def replace_server(environment=None, group=None, subnet_id=None,
 
         if prompt_before_replace:
 
-            print '\a'
-            _ = raw_input('Press enter to continue')
+            # Replica sets replaced at once take turns at the terminal
+            with prompt_lock:
+                print '\a'
+                _ = raw_input('Press enter to remove {member} from '
+                              '{name}'.format(member=member,
+                                              name=replica_set.name))
 
         replica_set.determine_primary(member)
 
@@ -620,7 +611,7 @@ def replace_server(environment=None, group=None, subnet_id=None,
             log.info('Redirecting previous DNS entry')
 
             log.debug('Establishing a connect to AWS Route53 us-east-1')
-            conn = boto.route53.connect_to_region('us-east-1')
+            conn = connection_registry.get('route53', 'us-east-1')
 
             log.debug('Retrieving the zone app.staghudl.com.')
             zone = conn.get_zone('app.staghudl.com.')
@@ -633,8 +624,122 @@ def replace_server(environment=None, group=None, subnet_id=None,
                 log.debug('Retrieving the zone thorhudl.com.')
                 zone = conn.get_zone('thorhudl.com.')
 
-            if zone.get_cname(member+'.') is None:
+            record = zone.get_cname(member+'.')
+
+            if record is None:
                 log.debug('An existing DNS record does not exist')
             else:
                 log.debug('Updating the DNS CNAME record')
-                zone.update_cname(member+'.', node.instance.private_dns_name)
+                batch = ChangeBatch(conn)
+                batch.upsert(zone.id, member+'.', 'CNAME',
+                             node.instance.private_dns_name, ttl=record.ttl)
+                batch.commit()
+
+
+def replica_set_name(server):
+
+    member = server.get('member')
+
+    try:
+        return mongo_admin(member).is_master()['setName']
+    except Exception as e:
+        # replace_server will fail on this entry and report why
+        log.warn('Unable to determine the replica set of {member}: {error}'
+                 .format(member=member, error=e))
+        return member
+
+
+class SpanFilter(logging.Filter):
+    """
+    Passes the records logged within `span`, including those of worker
+    threads which adopted it.
+    """
+
+    def __init__(self, span):
+
+        logging.Filter.__init__(self)
+        self.span = span
+
+    def filter(self, record):
+
+        return any(span is self.span for span in tracer.stack)
+
+
+def replace_replica_set(name, servers, log_directory):
+
+    threading.current_thread().name = 'ReplicaSet-{name}'.format(name=name)
+
+    path = os.path.join(log_directory, '{name}.log'.format(name=name))
+
+    handler = logging.FileHandler(path)
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(logging.Formatter(
+        '%(asctime)s [%(name)s] %(levelname)s: %(message)s',
+        datefmt='%H:%M:%S'))
+
+    # The whole Tyr hierarchy is captured, not just this module's log, from
+    # this thread and any helper thread working within its span
+    root = logging.getLogger('Tyr')
+
+    with tracer.span('replica-set', replica_set=name) as span:
+        handler.addFilter(SpanFilter(span))
+        root.addHandler(handler)
+
+        try:
+            for position, server in enumerate(servers):
+                log.info('Replacing {member} ({position} of {count} in '
+                         '{name})'.format(member=server.get('member'),
+                                          position=position + 1,
+                                          count=len(servers), name=name))
+
+                try:
+                    replace_server(**server)
+                except (Exception, SystemExit) as e:
+                    # replace_server exits on failure; stop this replica set
+                    # only, leaving the others running
+                    log.critical('Replacing {member} failed: {error}'.format(
+                                 member=server.get('member'),
+                                 error=repr(e)))
+                    raise Exception('Failed replacing {member}'.format(
+                                    member=server.get('member')))
+
+            log.info('Finished replacing {count} members of {name}'.format(
+                     count=len(servers), name=name))
+        finally:
+            root.removeHandler(handler)
+            handler.close()
+
+
+def replace_servers(servers, workers=4, log_directory='.'):
+    """
+    Replace servers grouped by their replica set. Replica sets are worked
+    on concurrently, up to `workers` at a time, while the members of each
+    set are replaced one after another in the order given. Each replica
+    set's progress is also logged to <log_directory>/<set>.log.
+    """
+
+    replica_sets = collections.OrderedDict()
+
+    for server in servers:
+        replica_sets.setdefault(replica_set_name(server), []).append(server)
+
+    log.info('Replacing {count} servers in {sets} replica sets'.format(
+             count=len(servers), sets=len(replica_sets)))
+
+    names = replica_sets.keys()
+
+    results, errors = for_each(
+        lambda name: replace_replica_set(name, replica_sets[name],
+                                         log_directory),
+        names, workers=workers)
+
+    failed = dict(errors)
+
+    for name in names:
+        if name in failed:
+            log.critical('{name}: {error}'.format(name=name,
+                                                  error=failed[name]))
+        else:
+            log.info('{name}: done'.format(name=name))
+
+    return not errors